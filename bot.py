@@ -3,11 +3,31 @@ import logging
 import threading
 import random
 import asyncio
+import atexit
+import bisect
+import copy
+import csv
 import datetime
+import inspect
+import io
 import json
+import math
+import multiprocessing
+import queue
+import re
+import sqlite3
+import sys
+import time
+import tracemalloc
+import types
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from http.server import BaseHTTPRequestHandler, HTTPServer
+from logging.handlers import QueueHandler, QueueListener
 
 import discord
+import numpy as np
+from discord import app_commands
 from discord.ext import commands, tasks
 from dotenv import load_dotenv
 import youtube_dl
@@ -16,12 +36,129 @@ import requests
 load_dotenv()
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+# Records are handed to a queue on the calling thread and formatted and written by a
+# listener thread, so a burst of errors never blocks the event loop on stdout.
+# Identical warnings and errors beyond LOG_SAMPLE_BURST per LOG_SAMPLE_WINDOW seconds
+# are counted instead of logged.
+LOG_SAMPLE_BURST = 5
+LOG_SAMPLE_WINDOW = 60
+# Commands slower than this are logged as warnings with their latency
+SLOW_COMMAND_MS = 2000
+# Structured fields copied from a record's ``extra`` into the JSON output
+LOG_FIELDS = ("guild", "channel", "user", "command", "latency_ms", "suppressed")
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in LOG_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class RepeatSampler(logging.Filter):
+    """Passes the first few identical warnings/errors per window and counts the rest.
+
+    The first record let through in a new window carries the number of copies
+    suppressed in the previous one as its ``suppressed`` field.
+    """
+
+    def __init__(self, burst=LOG_SAMPLE_BURST, window=LOG_SAMPLE_WINDOW, max_keys=1000):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.max_keys = max_keys
+        # (logger, level, message) -> [window_start, seen_in_window, suppressed_in_last_window]
+        self._seen = OrderedDict()
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING:
+            return True
+        key = (record.name, record.levelno, record.getMessage())
+        now = record.created
+        entry = self._seen.get(key)
+        if entry is None or now - entry[0] >= self.window:
+            suppressed = max(0, entry[1] - self.burst) if entry else 0
+            entry = self._seen[key] = [now, 0, suppressed]
+        self._seen.move_to_end(key)
+        if len(self._seen) > self.max_keys:
+            self._seen.popitem(last=False)
+
+        entry[1] += 1
+        if entry[1] > self.burst:
+            metrics["bot_log_suppressed_total"] += 1
+            return False
+        if entry[1] == 1 and entry[2]:
+            record.suppressed = entry[2]
+        return True
+
+class StructuredQueueHandler(QueueHandler):
+    def prepare(self, record):
+        # Resolve the message and traceback now, while the arguments are still valid,
+        # but leave the JSON rendering to the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+def setup_logging(level=logging.INFO):
+    """Route every logger through a queue to a JSON stdout handler on a listener thread."""
+    log_queue = queue.SimpleQueue()
+    queue_handler = StructuredQueueHandler(log_queue)
+    queue_handler.addFilter(RepeatSampler())
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level)
+    return listener
+
+def log_context(source, **fields):
+    """Structured ``extra`` fields for a log record about a command Context or Interaction."""
+    if isinstance(source, discord.Interaction):
+        command = source.command.qualified_name if source.command else None
+        return {"guild": source.guild_id, "channel": source.channel_id, "user": source.user.id, "command": command, **fields}
+    command = source.command.qualified_name if source.command else None
+    return {"guild": source.guild.id if source.guild else None, "channel": source.channel.id,
+            "user": source.author.id, "command": command, **fields}
+
+log_listener = setup_logging(os.getenv("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
+# Process-wide counters, served in Prometheus text format on /metrics
+metrics = Counter()
+
 # Define a simple HTTP handler for health checks
 class HealthHandler(BaseHTTPRequestHandler):
     def do_GET(self):
+        if self.path == "/metrics":
+            # dict() copies in one step, so the event loop can keep counting meanwhile
+            snapshot = dict(metrics)
+            body = "".join(f"{name} {value}\n" for name, value in sorted(snapshot.items()))
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.end_headers()
+            self.wfile.write(body.encode())
+            return
         self.send_response(200)
         self.end_headers()
         self.wfile.write(b"OK")
@@ -33,67 +170,884 @@ def run_health_server():
     logger.info("Starting health check server on port 8000")
     server.serve_forever()
 
-# Start the health check server in a background thread
+# The health check server runs in a background thread, started alongside the bot
 health_thread = threading.Thread(target=run_health_server, daemon=True)
-health_thread.start()
 
 # Set up Discord bot intents
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True  # Enable member intents for welcome messages
 
-# Create the bot instance with a command prefix and intents
-bot = commands.Bot(command_prefix='!', intents=intents)
+# --- Guild Settings ---
+DEFAULT_GUILD_SETTINGS = {
+    "prefix": "!",
+    "disabled_cogs": [],
+    "welcome_enabled": True,
+    "welcome_channel_id": None,  # None means the guild's system channel
+    "clear_limit": 10,
+    "subreddits": ["wallstreetbets", "investingmemes", "financememes", "algotrading", "options"],
+    "automod_enabled": False,
+    "automod_log_channel_id": None,  # None means the guild's system channel
+    "automod_actions": {"spam": ["delete", "timeout"], "flood": ["slowmode"], "raid": ["lockdown"]},
+    "signal_channel_id": None,  # None means watchlist signals aren't posted
+    # Verification level to restore when an automod lockdown ends; None when not locked down.
+    # Stored with the settings so a restart mid-raid can still be unlocked.
+    "automod_lockdown_level": None,
+}
+# Bot-wide settings; presence is shared by every guild so statuses can't be per guild
+DEFAULT_GLOBAL_SETTINGS = {
+    "statuses": [
+        ["playing", "with code"],
+        ["listening", "commands"],
+        ["watching", "the server"],
+        ["playing", "!help for commands"],
+    ],
+}
+# Cogs that can't be disabled, since they hold the settings commands themselves
+REQUIRED_COGS = {"moderation"}
+# Commands that stay available when their cog is disabled, so users can still find the rest
+ALWAYS_ENABLED_COMMANDS = {"help"}
 
-# on_ready event: sync commands and log startup
-@bot.event
-async def on_ready():
+def write_json_atomic(path, data, **kwargs):
+    """Write JSON to a temporary file beside ``path`` and swap it in, so a crash mid-write can't truncate it."""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(data, f, **kwargs)
+    os.replace(temp_path, path)
+
+def read_json(path, default):
+    """Load a JSON data file, or ``default`` if it's missing or unreadable.
+
+    An unreadable file is renamed to ``*.corrupt`` so the next write doesn't destroy it.
+    """
     try:
-        await bot.tree.sync()
-    except Exception as e:
-        logger.error("Error syncing commands: %s", e)
-    logger.info("Logged in as %s", bot.user)
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+    except json.JSONDecodeError as e:
+        logger.error("Couldn't parse %s, starting empty and keeping it as %s.corrupt: %s", path, path, e)
+        os.replace(path, f"{path}.corrupt")
+        return default
+
+class GuildSettingsStore:
+    """Per-guild settings persisted to a JSON file with an in-memory cache.
+
+    The file holds only the keys a guild has overridden. ``get`` merges them over
+    the defaults once and caches the result, so the lookup on every message is a
+    single dict access. ``set`` writes through to disk and invalidates the entry.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._cache = {}
+        data = read_json(path, {})
+        self._guilds = data.get("guilds", {})
+        self._global = data.get("global", {})
+
+    def _save(self):
+        write_json_atomic(self.path, {"guilds": self._guilds, "global": self._global}, indent=2)
+
+    def get(self, guild_id):
+        settings = self._cache.get(guild_id)
+        if settings is None:
+            settings = self._cache[guild_id] = {**DEFAULT_GUILD_SETTINGS, **self._guilds.get(str(guild_id), {})}
+        return settings
+
+    def set(self, guild_id, key, value):
+        if key not in DEFAULT_GUILD_SETTINGS:
+            raise KeyError(key)
+        overrides = self._guilds.setdefault(str(guild_id), {})
+        if value == DEFAULT_GUILD_SETTINGS[key]:
+            overrides.pop(key, None)
+        else:
+            overrides[key] = value
+        if not overrides:
+            del self._guilds[str(guild_id)]
+        self._save()
+        self._cache.pop(guild_id, None)
+
+    def get_global(self, key):
+        return self._global.get(key, DEFAULT_GLOBAL_SETTINGS[key])
+
+    def set_global(self, key, value):
+        if key not in DEFAULT_GLOBAL_SETTINGS:
+            raise KeyError(key)
+        self._global[key] = value
+        self._save()
+
+guild_settings = GuildSettingsStore(os.getenv("GUILD_SETTINGS_FILE", "guild_settings.json"))
+
+def get_prefix(bot, message):
+    # Called for every message, so this must stay an in-memory lookup
+    if message.guild is None:
+        return DEFAULT_GUILD_SETTINGS["prefix"]
+    return guild_settings.get(message.guild.id)["prefix"]
+
+# Create the bot instance with a per-guild command prefix and intents
+bot = commands.Bot(command_prefix=get_prefix, intents=intents)
+
+# --- Rate Limiting ---
+class RateLimiter:
+    """Token buckets keyed by arbitrary tuples.
+
+    Each bucket is stored as ``key -> (tokens, updated_at, expires_at)`` in an
+    OrderedDict kept in last-touched order. Once a bucket has refilled completely
+    it is indistinguishable from a missing one, so expired buckets are dropped
+    lazily from the front of the dict instead of being swept on a timer.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self._buckets = OrderedDict()
+        self._clock = clock
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def acquire(self, limits, cost=1):
+        """Take ``cost`` tokens from every bucket in ``limits`` or from none of them.
+
+        ``limits`` is a list of ``(key, capacity, per_seconds)``. Returns
+        ``(0.0, None)`` on success, otherwise ``(retry_after, key)`` for the
+        bucket that is furthest from having enough tokens.
+        """
+        now = self._clock()
+        buckets = self._buckets
+        levels = []
+        retry_after, limited_key = 0.0, None
+        for key, capacity, per in limits:
+            rate = capacity / per
+            entry = buckets.get(key)
+            tokens = capacity if entry is None else min(capacity, entry[0] + (now - entry[1]) * rate)
+            if tokens < cost and (cost - tokens) / rate > retry_after:
+                retry_after, limited_key = (cost - tokens) / rate, key
+            levels.append((key, capacity, rate, tokens))
+
+        if limited_key is None:
+            for key, capacity, rate, tokens in levels:
+                tokens -= cost
+                buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+                buckets.move_to_end(key)
+
+        self._expire(now)
+        return retry_after, limited_key
+
+    def _expire(self, now):
+        # The front of the dict is the least recently touched bucket
+        buckets = self._buckets
+        while buckets:
+            key = next(iter(buckets))
+            if buckets[key][2] > now:
+                break
+            del buckets[key]
+
+# Raised from both prefix-command and app-command checks, so it is a failure for both
+class RateLimited(commands.CheckFailure, app_commands.CheckFailure):
+    def __init__(self, scope, retry_after):
+        self.scope = scope
+        self.retry_after = retry_after
+        super().__init__(f"Rate limited by {scope} bucket, retry in {retry_after:.1f}s")
+
+# Token-bucket limits as (capacity, per_seconds) for each cost class and scope. Every
+# scope is per guild or narrower, so one busy guild can't lock the others out.
+# "class" covers all commands of a cost class in one guild.
+RATE_LIMITS = {
+    "expensive": {"user": (2, 30), "guild": (6, 30), "class": (30, 60)},
+    "cheap": {"user": (5, 10), "guild": (40, 10), "class": (400, 10)},
+}
+# Commands that run an extraction or outbound HTTP request; everything else is cheap
+COMMAND_COST_CLASS = {
+    "play": "expensive",
+    "stonks": "expensive",
+    "chart": "expensive",
+}
+# Bot-wide buckets, only for commands that share one upstream API across every guild.
+# Reddit allows about 100 requests a minute per client, however many guilds ask. Stooq
+# publishes no limit, and every chart may download history and use a render worker.
+FLEET_LIMITS = {
+    "stonks": (100, 60),
+    "chart": (60, 60),
+}
+# Minimum seconds between "slow down" replies to the same user
+RATE_LIMIT_NOTICE_INTERVAL = 10
+
+rate_limiter = RateLimiter()
+
+def check_rate_limit(user_id, guild_id, command_name):
+    """Charge one invocation of ``command_name`` and raise RateLimited if any bucket is empty."""
+    cost_class = COMMAND_COST_CLASS.get(command_name, "cheap")
+    limits = RATE_LIMITS[cost_class]
+    buckets = [(("user", user_id, command_name), *limits["user"])]
+    if guild_id is not None:
+        buckets.append((("guild", guild_id, command_name), *limits["guild"]))
+        buckets.append((("class", guild_id, cost_class), *limits["class"]))
+    if command_name in FLEET_LIMITS:
+        buckets.append((("fleet", command_name), *FLEET_LIMITS[command_name]))
+
+    retry_after, key = rate_limiter.acquire(buckets)
+    if key is not None:
+        metrics[f'bot_ratelimit_rejected_total{{scope="{key[0]}",command="{command_name}"}}'] += 1
+        raise RateLimited(key[0], retry_after)
+
+class CogDisabled(commands.CheckFailure, app_commands.CheckFailure):
+    pass
+
+def check_cog_enabled(guild_id, cog, command_name):
+    """Raise CogDisabled if ``cog`` is turned off in the guild."""
+    if guild_id is None or cog is None or command_name in ALWAYS_ENABLED_COMMANDS:
+        return
+    name = cog.qualified_name.removesuffix("Cog").lower()
+    if name in guild_settings.get(guild_id)["disabled_cogs"]:
+        raise CogDisabled(f"The {name} commands are disabled in this server")
+
+@bot.check
+async def cog_enabled_check(ctx):
+    check_cog_enabled(ctx.guild.id if ctx.guild else None, ctx.cog, ctx.command.qualified_name)
+    return True
+
+def subcommand_follows(ctx):
+    """Whether a group's checks are running ahead of a subcommand that will run its own."""
+    if not isinstance(ctx.command, commands.Group):
+        return False
+    # Peek at the next word the way Group.invoke will, then put the view back
+    view = ctx.view
+    index, previous = view.index, view.previous
+    view.skip_ws()
+    trigger = view.get_word()
+    view.index, view.previous = index, previous
+    return trigger in ctx.command.all_commands
+
+@bot.check
+async def rate_limit_check(ctx):
+    # Global checks run for a group and again for its subcommand; charge only the command that runs last
+    if subcommand_follows(ctx):
+        return True
+    check_rate_limit(ctx.author.id, ctx.guild.id if ctx.guild else None, ctx.command.qualified_name)
+    return True
+
+def app_rate_limit():
+    """App-command check applying the same disabled-cog rule and buckets as the prefix-command checks."""
+    async def predicate(interaction):
+        check_cog_enabled(interaction.guild_id, interaction.command.binding, interaction.command.qualified_name)
+        check_rate_limit(interaction.user.id, interaction.guild_id, interaction.command.qualified_name)
+        return True
+    return app_commands.check(predicate)
+
+@bot.event
+async def on_command_error(ctx, error):
+    if isinstance(error, CogDisabled):
+        return
+    if isinstance(error, RateLimited):
+        # Answer a spammer once per interval rather than once per rejected command
+        retry_after, _ = rate_limiter.acquire([(("notice", ctx.author.id), 1, RATE_LIMIT_NOTICE_INTERVAL)])
+        if not retry_after:
+            await ctx.send(f"⏳ Slow down! Try again in {error.retry_after:.0f}s.", delete_after=5)
+        return
+    await commands.Bot.on_command_error(bot, ctx, error)
+
+@bot.tree.error
+async def on_app_command_error(interaction, error):
+    if isinstance(error, CogDisabled):
+        # Unlike prefix commands, an interaction must be answered or it shows as failed
+        await interaction.response.send_message(f"🚫 {error}.", ephemeral=True)
+        return
+    if isinstance(error, RateLimited):
+        message = f"⏳ Slow down! Try again in {error.retry_after:.0f}s."
+        if interaction.response.is_done():
+            await interaction.followup.send(message, ephemeral=True)
+        else:
+            await interaction.response.send_message(message, ephemeral=True)
+        return
+    await app_commands.CommandTree.on_error(bot.tree, interaction, error)
+
+@bot.before_invoke
+async def start_command_timer(ctx):
+    ctx.started_at = time.perf_counter()
+
+@bot.after_invoke
+async def log_command_latency(ctx):
+    latency_ms = round((time.perf_counter() - ctx.started_at) * 1000, 1)
+    level = logging.WARNING if latency_ms >= SLOW_COMMAND_MS else logging.DEBUG
+    logger.log(level, "Command %s finished", ctx.command.qualified_name, extra=log_context(ctx, latency_ms=latency_ms))
+    # after_invoke fires for a group and again for its subcommand; count only the last command that ran
+    if ctx.invoked_subcommand is None:
+        usage_stats.increment(ctx.guild.id if ctx.guild else 0, ctx.command, ctx.author.id)
+
+@bot.listen()
+async def on_app_command_completion(interaction, command):
+    # Slash commands don't pass through after_invoke; count them under the same name
+    usage_stats.increment(interaction.guild_id or 0, command, interaction.user.id)
+
+@bot.command(name="loglevel")
+@commands.is_owner()
+async def loglevel(ctx, name: str = None, level: str = None):
+    """Show or change a logger's level at runtime, e.g. `!loglevel music DEBUG`"""
+    loggers = {cog.qualified_name.removesuffix("Cog").lower(): cog.logger for cog in bot.cogs.values() if hasattr(cog, "logger")}
+    loggers.update({"bot": logger, "discord": logging.getLogger("discord")})
+    if name is None:
+        lines = [f"{key}: {logging.getLevelName(value.getEffectiveLevel())}" for key, value in sorted(loggers.items())]
+        return await ctx.send("```\n" + "\n".join(lines) + "\n```")
     
-    # Start background tasks
-    status_updater.start()
+    target = loggers.get(name.lower())
+    if target is None:
+        return await ctx.send(f"Unknown logger '{name}'. Choose from: {', '.join(sorted(loggers))}")
+    if level is None or not isinstance(logging.getLevelName(level.upper()), int):
+        return await ctx.send("Level must be one of DEBUG, INFO, WARNING, ERROR or CRITICAL.")
+    target.setLevel(level.upper())
+    await ctx.send(f"Log level for `{name.lower()}` set to {level.upper()}.")
+
+# --- Diagnostics ---
+MEMORY_SNAPSHOT_DIR = os.getenv("MEMORY_SNAPSHOT_DIR", "memory_snapshots")
+MEMORY_SNAPSHOTS_KEPT = 24
+# Frames kept per allocation; enough to reach bot.py from most library calls while
+# keeping snapshots cheap to take
+TRACEMALLOC_FRAMES = 10
+MEMORY_TOP_SITES = 8
+# Objects visited per structure when estimating its size, so huge caches can't stall the loop
+SIZEOF_LIMIT = 50000
+
+memory_baseline = None
+_cog_line_ranges = {}  # cog class -> (first_line, last_line)
+
+def deep_sizeof(obj, limit=SIZEOF_LIMIT):
+    """Approximate bytes held by ``obj`` and the containers and plain objects it references.
+
+    discord.py models, coroutines, tasks and executors are counted shallowly; following
+    them would walk the whole client cache. Returns ``(bytes, complete)``.
+    """
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        if len(seen) >= limit:
+            return total, False
+        item = stack.pop()
+        if id(item) in seen or isinstance(item, (type, types.ModuleType, types.FunctionType, types.MethodType)):
+            continue
+        seen.add(id(item))
+        if isinstance(item, np.ndarray):
+            total += item.nbytes + sys.getsizeof(item, 0)
+            continue
+        total += sys.getsizeof(item, 0)
+        module = type(item).__module__ or ""
+        if module.startswith(("discord", "asyncio", "concurrent", "threading", "sqlite3")):
+            continue
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset, deque)):
+            stack.extend(item)
+        elif hasattr(item, "__dict__"):
+            stack.append(item.__dict__)
+    return total, True
+
+def state_sizes():
+    """``(name, length, bytes, complete)`` for each container held by a cog or bot-wide service."""
+    owners = [(cog.qualified_name, cog) for cog in bot.cogs.values()]
+    owners += [("outbox", outbox), ("rate_limiter", rate_limiter), ("guild_settings", guild_settings),
+               ("usage_stats", usage_stats), ("scanner", scanner)]
+    rows = []
+    for owner_name, owner in owners:
+        for name, value in vars(owner).items():
+            # Dunder attributes are discord.py's command bookkeeping, not bot state
+            if name.startswith("__") or value is bot or isinstance(value, (str, bytes, int, float, bool, type(None))):
+                continue
+            if not hasattr(value, "__len__") and not hasattr(value, "__dict__"):
+                continue
+            size, complete = deep_sizeof(value)
+            length = len(value) if hasattr(value, "__len__") else None
+            rows.append((f"{owner_name}.{name.lstrip('_')}", length, size, complete))
+    return sorted(rows, key=lambda row: row[2], reverse=True)
+
+def cache_counts():
+    """Objects held in discord.py's gateway cache."""
+    return {
+        "guilds": len(bot.guilds),
+        "users": len(bot.users),
+        "members": sum(len(guild.members) for guild in bot.guilds),
+        "channels": sum(len(guild.channels) for guild in bot.guilds),
+        "roles": sum(len(guild.roles) for guild in bot.guilds),
+        "emojis": len(bot.emojis),
+        "messages": len(bot.cached_messages),
+        "voice_clients": len(bot.voice_clients),
+    }
+
+def cog_line_ranges():
+    """``(first_line, last_line, cog_name)`` for every cog class defined in this file."""
+    ranges = []
+    for cog in bot.cogs.values():
+        cls = type(cog)
+        # inspect parses the whole file, which is slow while tracing, so do it once per class
+        if cls not in _cog_line_ranges:
+            try:
+                lines, start = inspect.getsourcelines(cls)
+            except (OSError, TypeError):
+                _cog_line_ranges[cls] = None
+            else:
+                _cog_line_ranges[cls] = (start, start + len(lines) - 1)
+        if _cog_line_ranges[cls] is not None:
+            ranges.append((*_cog_line_ranges[cls], cog.qualified_name))
+    return ranges
+
+def allocation_owner(traceback, ranges):
+    """Attribute an allocation to the innermost cog frame, else the innermost bot.py line, else its library."""
+    this_file = os.path.abspath(__file__)
+    for frame in reversed(traceback):
+        if os.path.abspath(frame.filename) == this_file:
+            for start, end, name in ranges:
+                if start <= frame.lineno <= end:
+                    return name
+            return "bot.py"
+    path = traceback[-1].filename.replace(os.sep, "/")
+    if "site-packages/" in path:
+        return path.split("site-packages/", 1)[1].split("/", 1)[0]
+    return os.path.splitext(os.path.basename(path))[0]
+
+def take_memory_snapshot():
+    # Our own bookkeeping would otherwise show up as the largest growth
+    return tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    ])
+
+def memory_report(baseline, ranges):
+    """Diff a fresh snapshot against ``baseline``: growth per owner and the top allocation sites. Blocking."""
+    snapshot = take_memory_snapshot()
+    by_owner = Counter()
+    for diff in snapshot.compare_to(baseline, "traceback"):
+        by_owner[allocation_owner(diff.traceback, ranges)] += diff.size_diff
+    sites = snapshot.compare_to(baseline, "lineno")[:MEMORY_TOP_SITES]
+    return by_owner, sites
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB"):
+        if abs(size) < 1024:
+            return f"{size:,.0f} {unit}" if unit == "B" else f"{size:,.1f} {unit}"
+        size /= 1024
+    return f"{size:,.1f} GB"
+
+@bot.group(name="debug")
+@commands.is_owner()
+async def debug(ctx):
+    """Owner-only diagnostics"""
+    # Not invoke_without_command, so the owner check above also guards every subcommand
+    if ctx.invoked_subcommand is None:
+        await ctx.send("Usage: `!debug mem [reset|every <minutes>|stop|off]`")
+
+@debug.group(name="mem")
+async def debug_mem(ctx):
+    """Memory growth since the baseline, state structure sizes and discord.py cache counts"""
+    global memory_baseline
+    if ctx.invoked_subcommand is not None:
+        return
+    # `every` can start tracing without a baseline, so take one here if it's missing
+    if not tracemalloc.is_tracing() or memory_baseline is None:
+        cog_line_ranges()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        memory_baseline = await bot.loop.run_in_executor(None, take_memory_snapshot)
+        return await ctx.send("Started tracing allocations and took a baseline. Run `!debug mem` again to see what grew.")
     
-    # Load polls and reminders if they exist
-    utility_cog = bot.get_cog("UtilityCog")
-    if utility_cog:
-        utility_cog.load_data()
-        utility_cog.check_reminders.start()
+    async with ctx.typing():
+        ranges = cog_line_ranges()
+        by_owner, sites = await bot.loop.run_in_executor(None, memory_report, memory_baseline, ranges)
+        sizes = state_sizes()
+    current, peak = tracemalloc.get_traced_memory()
+    
+    lines = [f"Traced: {format_bytes(current)} (peak {format_bytes(peak)})", "", "Growth since baseline by owner:"]
+    lines += [f"  {name:<16} {format_bytes(size):>12}" for name, size in by_owner.most_common(8) if size]
+    lines += ["", "Top allocation sites:"]
+    for diff in sites:
+        frame = diff.traceback[0]
+        lines.append(f"  {format_bytes(diff.size_diff):>10} {os.path.basename(frame.filename)}:{frame.lineno} ({diff.count_diff:+,} blocks)")
+    lines += ["", "State structures:"]
+    for name, length, size, complete in sizes[:12]:
+        items = "" if length is None else f" {length:,} items"
+        lines.append(f"  {name:<28}{items:>14} {'' if complete else '>'}{format_bytes(size):>10}")
+    lines += ["", "discord.py cache: " + ", ".join(f"{name} {count:,}" for name, count in cache_counts().items())]
+    
+    text = "\n".join(lines)
+    if len(text) > 1900:
+        text = text[:1900] + "\n…"
+    await ctx.send(f"```\n{text}\n```")
+
+@debug_mem.command(name="reset")
+async def debug_mem_reset(ctx):
+    """Take a new baseline"""
+    global memory_baseline
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    memory_baseline = await bot.loop.run_in_executor(None, take_memory_snapshot)
+    await ctx.send("New memory baseline taken.")
+
+@debug_mem.command(name="every")
+async def debug_mem_every(ctx, minutes: float):
+    """Write a snapshot to disk every few minutes"""
+    global memory_baseline
+    if minutes < 1:
+        return await ctx.send("The interval must be at least one minute.")
+    if not tracemalloc.is_tracing():
+        cog_line_ranges()
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        memory_baseline = await bot.loop.run_in_executor(None, take_memory_snapshot)
+    memory_snapshots.change_interval(minutes=minutes)
+    if not memory_snapshots.is_running():
+        memory_snapshots.start()
+    await ctx.send(f"Writing a memory snapshot to `{MEMORY_SNAPSHOT_DIR}/` every {minutes:g} minutes; the last {MEMORY_SNAPSHOTS_KEPT} are kept.")
+
+@debug_mem.command(name="stop")
+async def debug_mem_stop(ctx):
+    """Stop writing periodic snapshots"""
+    memory_snapshots.cancel()
+    await ctx.send("Stopped writing memory snapshots.")
+
+@debug_mem.command(name="off")
+async def debug_mem_off(ctx):
+    """Stop tracing allocations and drop the baseline"""
+    global memory_baseline
+    memory_snapshots.cancel()
+    tracemalloc.stop()
+    memory_baseline = None
+    await ctx.send("Stopped tracing allocations.")
+
+def write_memory_snapshot():
+    """Dump a snapshot for offline diffing with ``tracemalloc.Snapshot.load``. Blocking."""
+    os.makedirs(MEMORY_SNAPSHOT_DIR, exist_ok=True)
+    path = os.path.join(MEMORY_SNAPSHOT_DIR, time.strftime("%Y%m%d-%H%M%S.snapshot"))
+    take_memory_snapshot().dump(path)
+    snapshots = sorted(name for name in os.listdir(MEMORY_SNAPSHOT_DIR) if name.endswith(".snapshot"))
+    for name in snapshots[:-MEMORY_SNAPSHOTS_KEPT]:
+        os.remove(os.path.join(MEMORY_SNAPSHOT_DIR, name))
+    return path
+
+@tasks.loop(minutes=15)
+async def memory_snapshots():
+    if not tracemalloc.is_tracing():
+        return
+    try:
+        path = await bot.loop.run_in_executor(None, write_memory_snapshot)
+    except Exception as e:
+        logger.error("Error writing memory snapshot: %s", e)
+        return
+    current, peak = tracemalloc.get_traced_memory()
+    logger.info("Wrote memory snapshot %s (traced %s, peak %s)", path, format_bytes(current), format_bytes(peak))
+
+# --- Outbound Messages ---
+# Discord allows about 5 messages per 5 seconds per channel and 50 requests per second overall
+CHANNEL_SEND_LIMIT = (5, 5)
+GLOBAL_SEND_LIMIT = (50, 1)
+# Seconds a channel worker waits for more messages before shutting down
+DISPATCH_IDLE_TIMEOUT = 30
+# Seconds a coalesced batch stays open before it is sent as one message
+COALESCE_WINDOW = 3
+
+class MessageDispatcher:
+    """Queues outbound messages per channel and paces them to Discord's buckets.
+
+    Every channel gets its own FIFO worker that waits on the channel and global
+    token buckets before sending, so bursts are spread out ahead of time instead
+    of being answered with 429s. Workers exit after sitting idle.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.limiter = RateLimiter()
+        self._queues = {}
+        self._workers = {}
+        self._batches = {}
+
+    def send(self, channel, content=None, **kwargs):
+        """Queue a message and return a future resolving to the sent Message (None on failure)."""
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.get(channel.id)
+        if queue is None:
+            queue = self._queues[channel.id] = asyncio.Queue()
+            self._workers[channel.id] = asyncio.create_task(self._drain(channel.id, queue))
+        queue.put_nowait((channel, content, kwargs, future))
+        metrics["bot_dispatch_queued_total"] += 1
+        return future
+
+    def coalesce(self, channel, key, item, render, window=COALESCE_WINDOW):
+        """Add ``item`` to the batch ``key`` and send one message for the whole batch.
+
+        The first item opens the batch. After ``window`` seconds ``render(items)``
+        is called and must return the keyword arguments for ``send``.
+        """
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = []
+            asyncio.get_running_loop().call_later(window, self._flush_batch, channel, key, render)
+        batch.append(item)
+
+    def _flush_batch(self, channel, key, render):
+        items = self._batches.pop(key)
+        metrics["bot_dispatch_coalesced_total"] += len(items) - 1
+        try:
+            self.send(channel, **render(items))
+        except Exception as e:
+            logger.error("Error rendering coalesced message for %s: %s", key, e)
+
+    async def resolve_user(self, user_id):
+        """Return a user from the cache, falling back to a REST fetch."""
+        user = self.bot.get_user(user_id)
+        if user is None:
+            metrics["bot_dispatch_user_fetch_total"] += 1
+            user = await self.bot.fetch_user(user_id)
+        return user
+
+    async def _wait_for_bucket(self, channel_id):
+        while True:
+            retry_after, _ = self.limiter.acquire([
+                (("channel", channel_id), *CHANNEL_SEND_LIMIT),
+                (("global",), *GLOBAL_SEND_LIMIT),
+            ])
+            if not retry_after:
+                return
+            metrics["bot_dispatch_throttled_total"] += 1
+            await asyncio.sleep(retry_after)
+
+    async def _drain(self, channel_id, queue):
+        while True:
+            try:
+                channel, content, kwargs, future = await asyncio.wait_for(queue.get(), DISPATCH_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                # Nothing can be queued between the timeout and these deletes
+                if queue.empty():
+                    del self._queues[channel_id]
+                    del self._workers[channel_id]
+                    return
+                continue
+
+            await self._wait_for_bucket(channel_id)
+            try:
+                message = await channel.send(content, **kwargs)
+            except Exception as e:
+                logger.error("Error sending queued message to channel %s: %s", channel_id, e)
+                message = None
+            metrics["bot_dispatch_sent_total"] += 1
+            if not future.done():
+                future.set_result(message)
+
+outbox = MessageDispatcher(bot)
 
 # Status rotation task
 @tasks.loop(minutes=10)
 async def status_updater():
-    statuses = [
-        discord.Game(name="with code"),
-        discord.Activity(type=discord.ActivityType.listening, name="commands"),
-        discord.Activity(type=discord.ActivityType.watching, name="the server"),
-        discord.Game(name="!help for commands")
-    ]
-    await bot.change_presence(activity=random.choice(statuses))
+    activity_type, name = random.choice(guild_settings.get_global("statuses"))
+    if activity_type == "playing":
+        activity = discord.Game(name=name)
+    else:
+        activity = discord.Activity(type=getattr(discord.ActivityType, activity_type), name=name)
+    await bot.change_presence(activity=activity)
 
 # Welcome new members
-@bot.event
-async def on_member_join(member):
-    # Send welcome message in system channel if it exists
-    if member.guild.system_channel:
+# Most members named individually in a coalesced welcome embed
+WELCOME_MENTION_LIMIT = 30
+
+def render_welcome(members):
+    """Build one welcome embed for a batch of members that joined the same guild."""
+    guild = members[0].guild
+    prefix = guild_settings.get(guild.id)["prefix"]
+    if len(members) == 1:
+        member = members[0]
         embed = discord.Embed(
-            title=f"Welcome to {member.guild.name}!",
-            description=f"Hello {member.mention}! Thanks for joining us. Use `!help` to see my commands.",
+            title=f"Welcome to {guild.name}!",
+            description=f"Hello {member.mention}! Thanks for joining us. Use `{prefix}help` to see my commands.",
             color=discord.Color.green()
         )
         embed.set_thumbnail(url=member.avatar.url if member.avatar else member.default_avatar.url)
-        embed.set_footer(text=f"Member #{len(member.guild.members)}")
-        await member.guild.system_channel.send(embed=embed)
+    else:
+        mentions = " ".join(m.mention for m in members[:WELCOME_MENTION_LIMIT])
+        if len(members) > WELCOME_MENTION_LIMIT:
+            mentions += f" and {len(members) - WELCOME_MENTION_LIMIT} more"
+        embed = discord.Embed(
+            title=f"Welcome {len(members)} new members to {guild.name}!",
+            description=f"Hello {mentions}! Thanks for joining us. Use `{prefix}help` to see my commands.",
+            color=discord.Color.green()
+        )
+    embed.set_footer(text=f"Member #{len(guild.members)}")
+    return {"embed": embed}
+
+@bot.event
+async def on_member_join(member):
+    # Send welcome message in the configured or system channel, batching joins that arrive together
+    automod = bot.get_cog("AutoModCog")
+    if automod and await automod.check_join(member):
+        return  # No welcomes while a raid is in progress
+    settings = guild_settings.get(member.guild.id)
+    if not settings["welcome_enabled"]:
+        return
+    channel = member.guild.get_channel(settings["welcome_channel_id"] or 0) or member.guild.system_channel
+    if channel:
+        outbox.coalesce(channel, ("welcome", member.guild.id), member, render_welcome)
 
 # --- Music Commands ---
+YDL_OPTIONS = {
+    'format': 'bestaudio/best',
+    'postprocessors': [{
+        'key': 'FFmpegExtractAudio',
+        'preferredcodec': 'mp3',
+        'preferredquality': '192',
+    }],
+    'quiet': True,
+    'default_search': 'ytsearch',
+    'noplaylist': True
+}
+# Recently resolved tracks kept for /play autocomplete
+TRACK_CACHE_SIZE = 500
+# On-disk cache of transcoded Opus files for frequently played tracks
+AUDIO_CACHE_DIR = os.getenv("AUDIO_CACHE_DIR", "audio_cache")
+AUDIO_CACHE_MAX_BYTES = int(os.getenv("AUDIO_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+# Plays of an uncached track before it is transcoded into the cache
+AUDIO_CACHE_FILL_AFTER = 3
+# Uncached tracks whose play counts are remembered
+AUDIO_CACHE_MAX_COUNTED = 10000
+
+class CachedOpusAudio(discord.AudioSource):
+    """Plays an Ogg Opus file from disk packet by packet, with no FFmpeg process."""
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._packets = discord.oggparse.OggStream(self._file).iter_packets()
+
+    def read(self):
+        for packet in self._packets:
+            # Everything after the two header packets is a 20ms Opus frame
+            if packet.startswith((b'OpusHead', b'OpusTags')):
+                continue
+            return packet
+        return b''
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        self._file.close()
+
+class AudioCache:
+    """Transcoded Opus files keyed by video ID, evicted least recently played first by total bytes.
+
+    A track is only transcoded after it has been played ``fill_after`` times, so
+    one-off requests never push out a guild's favourites. The index is persisted
+    when files are added or evicted; recency changes from hits are not, so after a
+    restart the eviction order is approximate.
+    """
+
+    def __init__(self, directory, max_bytes, fill_after):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.fill_after = fill_after
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # video_id -> size in bytes, least recently played first
+        self._play_counts = OrderedDict()
+        self._fills = {}
+        self._load_index()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _path(self, video_id):
+        return os.path.join(self.directory, f"{video_id}.opus")
+
+    def _load_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            with open(os.path.join(self.directory, 'index.json'), 'r') as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            entries = []
+        for video_id, size in entries:
+            if os.path.exists(self._path(video_id)):
+                self._entries[video_id] = size
+                self.total_bytes += size
+        metrics["bot_audio_cache_bytes"] = self.total_bytes
+
+    def _save_index(self):
+        with open(os.path.join(self.directory, 'index.json'), 'w') as f:
+            json.dump(list(self._entries.items()), f)
+
+    def lookup(self, video_id):
+        """Return the cached file for ``video_id`` and mark it recently played, or None."""
+        path = self._path(video_id)
+        if video_id in self._entries and os.path.exists(path):
+            self._entries.move_to_end(video_id)
+            self.hits += 1
+            metrics["bot_audio_cache_hits_total"] += 1
+            return path
+        self.misses += 1
+        metrics["bot_audio_cache_misses_total"] += 1
+        return None
+
+    def record_play(self, video_id, stream_url):
+        """Count a play of an uncached track and start transcoding it once it is popular."""
+        if video_id in self._fills:
+            return
+        count = self._play_counts.pop(video_id, 0) + 1
+        if count >= self.fill_after:
+            self._fills[video_id] = asyncio.create_task(self._fill(video_id, stream_url))
+            return
+        self._play_counts[video_id] = count
+        if len(self._play_counts) > AUDIO_CACHE_MAX_COUNTED:
+            self._play_counts.popitem(last=False)
+
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    async def _fill(self, video_id, stream_url):
+        path = self._path(video_id)
+        partial = path + ".part"
+        try:
+            process = await asyncio.create_subprocess_exec(
+                "ffmpeg", "-nostdin", "-loglevel", "error",
+                "-reconnect", "1", "-reconnect_streamed", "1", "-reconnect_delay_max", "5",
+                "-i", stream_url, "-vn", "-map_metadata", "-1",
+                "-c:a", "libopus", "-b:a", "128k", "-ar", "48000", "-ac", "2", "-frame_duration", "20",
+                "-f", "ogg", "-y", partial,
+                stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+            )
+            _, stderr = await process.communicate()
+            if process.returncode != 0:
+                raise RuntimeError(stderr.decode(errors="replace").strip()[-300:])
+            os.replace(partial, path)
+            
+            size = os.path.getsize(path)
+            self._entries[video_id] = size
+            self.total_bytes += size
+            self._evict()
+            self._save_index()
+            metrics["bot_audio_cache_fills_total"] += 1
+            MusicCog.logger.info("Cached track %s (%d bytes)", video_id, size)
+        except Exception as e:
+            MusicCog.logger.warning("Could not cache track %s: %s", video_id, e)
+            if os.path.exists(partial):
+                os.remove(partial)
+        finally:
+            self._fills.pop(video_id, None)
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self._entries:
+            video_id, size = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(self._path(video_id))
+            except FileNotFoundError:
+                pass
+            metrics["bot_audio_cache_evictions_total"] += 1
+        metrics["bot_audio_cache_bytes"] = self.total_bytes
+
 class MusicCog(commands.Cog):
+    logger = logging.getLogger("algobot.music")
+
     def __init__(self, bot):
         self.bot = bot
         self.queue = {}
         self.now_playing = {}
+        self.track_cache = OrderedDict()
+        self.audio_cache = AudioCache(AUDIO_CACHE_DIR, AUDIO_CACHE_MAX_BYTES, AUDIO_CACHE_FILL_AFTER)
 
     @commands.command(name="join")
     async def join(self, ctx):
@@ -114,79 +1068,123 @@ class MusicCog(commands.Cog):
                 await ctx.send("You're not connected to a voice channel.")
                 return
         
-        # Initialize queue for this guild if it doesn't exist
-        guild_id = ctx.guild.id
-        if guild_id not in self.queue:
-            self.queue[guild_id] = []
-        
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
-            'quiet': True,
-            'default_search': 'ytsearch',
-            'noplaylist': True
-        }
-        
         try:
             await ctx.send("🔍 Searching...")
-            with youtube_dl.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(f"ytsearch:{query}" if not query.startswith("http") else query, download=False)
-                if 'entries' in info:
-                    # It's a search result
-                    info = info['entries'][0]
-                audio_url = info['url']
-                title = info.get('title', 'Unknown Title')
-                duration = info.get('duration', 0)
-                thumbnail = info.get('thumbnail', '')
-                
-                # Add to queue
-                self.queue[guild_id].append({
-                    'url': audio_url,
-                    'title': title,
-                    'requester': ctx.author.name,
-                    'duration': duration,
-                    'thumbnail': thumbnail
-                })
-                
-                # Create embed
-                embed = discord.Embed(
-                    title="Added to Queue",
-                    description=f"[{title}]({info.get('webpage_url', '')})",
-                    color=discord.Color.blue()
-                )
-                embed.add_field(name="Duration", value=self._format_duration(duration))
-                embed.add_field(name="Requested by", value=ctx.author.name)
-                
-                if thumbnail:
-                    embed.set_thumbnail(url=thumbnail)
-                
-                await ctx.send(embed=embed)
-                
-                # If nothing is playing, start the queue
-                if not ctx.voice_client.is_playing():
-                    await self._play_next(ctx)
+            embed = await self._queue_track(ctx.guild, ctx.author.name, query)
+            await ctx.send(embed=embed)
+            
+            # If nothing is playing, start the queue
+            if not ctx.voice_client.is_playing():
+                await self._play_next(ctx.guild, ctx.channel)
         except Exception as e:
             await ctx.send("An error occurred while trying to play the track.")
-            logger.error(f"Error in play command: {e}")
+            self.logger.error("Error in play command: %s", e, extra=log_context(ctx))
 
-    async def _play_next(self, ctx):
-        guild_id = ctx.guild.id
+    @app_commands.command(name="play", description="Search and play a song from YouTube")
+    @app_commands.describe(query="A search query or YouTube URL")
+    @app_commands.guild_only()
+    @app_rate_limit()
+    async def play_slash(self, interaction: discord.Interaction, query: str):
+        guild = interaction.guild
+        if guild.voice_client is None and not interaction.user.voice:
+            return await interaction.response.send_message("You're not connected to a voice channel.", ephemeral=True)
+        
+        # Acknowledge right away; connecting and extracting can take several seconds
+        await interaction.response.defer(thinking=True)
+        try:
+            if guild.voice_client is None:
+                await interaction.user.voice.channel.connect()
+            embed = await self._queue_track(guild, interaction.user.name, query)
+            await interaction.followup.send(embed=embed)
+            
+            if not guild.voice_client.is_playing():
+                await self._play_next(guild, interaction.channel)
+        except Exception as e:
+            await interaction.followup.send("An error occurred while trying to play the track.")
+            self.logger.error("Error in play slash command: %s", e, extra=log_context(interaction))
+
+    @play_slash.autocomplete("query")
+    async def play_autocomplete(self, interaction: discord.Interaction, current: str):
+        # Served from tracks we've already resolved; a live search per keystroke is far too slow
+        current = current.lower()
+        choices = []
+        for url, title in reversed(self.track_cache.items()):
+            if current in title.lower():
+                choices.append(app_commands.Choice(name=title[:100], value=url))
+                if len(choices) == 25:
+                    break
+        return choices
+
+    def _extract(self, query):
+        """Resolve a search query or URL with youtube_dl. Blocking, so run it in an executor."""
+        with youtube_dl.YoutubeDL(YDL_OPTIONS) as ydl:
+            info = ydl.extract_info(f"ytsearch:{query}" if not query.startswith("http") else query, download=False)
+        if 'entries' in info:
+            # It's a search result
+            info = info['entries'][0]
+        return info
+
+    async def _queue_track(self, guild, requester, query):
+        """Extract ``query`` off the event loop, queue it and return the "Added to Queue" embed."""
+        info = await self.bot.loop.run_in_executor(None, self._extract, query)
+        title = info.get('title', 'Unknown Title')
+        duration = info.get('duration', 0)
+        thumbnail = info.get('thumbnail', '')
+        webpage_url = info.get('webpage_url', '')
+        
+        # Add to queue, initializing it for this guild if it doesn't exist
+        self.queue.setdefault(guild.id, []).append({
+            'id': info.get('id'),
+            'url': info['url'],
+            'title': title,
+            'requester': requester,
+            'duration': duration,
+            'thumbnail': thumbnail
+        })
+        
+        # Remember the track for autocomplete, evicting the least recently played
+        if webpage_url:
+            self.track_cache[webpage_url] = title
+            self.track_cache.move_to_end(webpage_url)
+            if len(self.track_cache) > TRACK_CACHE_SIZE:
+                self.track_cache.popitem(last=False)
+        
+        # Create embed
+        embed = discord.Embed(
+            title="Added to Queue",
+            description=f"[{title}]({webpage_url})",
+            color=discord.Color.blue()
+        )
+        embed.add_field(name="Duration", value=self._format_duration(duration))
+        embed.add_field(name="Requested by", value=requester)
+        
+        if thumbnail:
+            embed.set_thumbnail(url=thumbnail)
+        return embed
+
+    async def _play_next(self, guild, channel):
+        guild_id = guild.id
         
         if guild_id in self.queue and self.queue[guild_id]:
             # Get the next track
             track = self.queue[guild_id].pop(0)
             self.now_playing[guild_id] = track
             
-            # Play the track
-            ctx.voice_client.play(
-                discord.FFmpegPCMAudio(track['url']),
+            # Play the track, straight from disk if it's in the audio cache
+            video_id = track.get('id')
+            cached_path = self.audio_cache.lookup(video_id) if video_id else None
+            if cached_path:
+                source = CachedOpusAudio(cached_path)
+            else:
+                source = discord.FFmpegPCMAudio(track['url'])
+                if video_id:
+                    self.audio_cache.record_play(video_id, track['url'])
+            
+            guild.voice_client.play(
+                source,
                 after=lambda e: asyncio.run_coroutine_threadsafe(
-                    self._play_next(ctx), self.bot.loop
-                ) if e is None else logger.error(f"Player error: {e}")
+                    self._play_next(guild, channel), self.bot.loop
+                ) if e is None else self.logger.error("Player error: %s", e, extra={"guild": guild.id})
             )
             
             # Send now playing message
@@ -201,10 +1199,10 @@ class MusicCog(commands.Cog):
             if track['thumbnail']:
                 embed.set_thumbnail(url=track['thumbnail'])
                 
-            await ctx.send(embed=embed)
+            await channel.send(embed=embed)
         else:
             self.now_playing.pop(guild_id, None)
-            await ctx.send("Queue finished. Use `!play` to add more songs.")
+            await channel.send("Queue finished. Use `!play` to add more songs.")
 
     def _format_duration(self, duration):
         if not duration:
@@ -248,6 +1246,16 @@ class MusicCog(commands.Cog):
             
         await ctx.send(embed=embed)
 
+    @commands.command(name="cache")
+    async def cache(self, ctx):
+        """Show the audio cache size and hit ratio"""
+        cache = self.audio_cache
+        embed = discord.Embed(title="Audio Cache", color=discord.Color.blue())
+        embed.add_field(name="Tracks", value=len(cache))
+        embed.add_field(name="Size", value=f"{cache.total_bytes / 1024 ** 2:.1f} / {cache.max_bytes / 1024 ** 2:.0f} MB")
+        embed.add_field(name="Hit Ratio", value=f"{cache.hit_ratio():.0%} ({cache.hits}/{cache.hits + cache.misses})")
+        await ctx.send(embed=embed)
+
     @commands.command(name="skip")
     async def skip(self, ctx):
         if ctx.voice_client and ctx.voice_client.is_playing():
@@ -284,9 +1292,259 @@ class MusicCog(commands.Cog):
             await ctx.send("I'm not connected to a voice channel.")
 
 # --- Moderation Commands ---
+MODLOG_DB = os.getenv("MODLOG_DB", "modlog.db")
+# Queued actions are written once this many are pending or after MODLOG_FLUSH_INTERVAL seconds
+MODLOG_BATCH_SIZE = 500
+MODLOG_FLUSH_INTERVAL = 2
+MODLOG_PAGE_SIZE = 10
+
+MODLOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS actions (
+    id INTEGER PRIMARY KEY,
+    created_at REAL NOT NULL,
+    guild_id INTEGER NOT NULL,
+    action TEXT NOT NULL,
+    user_id INTEGER,
+    user_name TEXT NOT NULL DEFAULT '',
+    moderator_id INTEGER NOT NULL,
+    moderator_name TEXT NOT NULL,
+    channel_id INTEGER,
+    reason TEXT NOT NULL DEFAULT '',
+    context TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS actions_by_guild ON actions (guild_id, id);
+CREATE INDEX IF NOT EXISTS actions_by_time ON actions (guild_id, created_at);
+CREATE INDEX IF NOT EXISTS actions_by_user ON actions (guild_id, user_id, id);
+CREATE INDEX IF NOT EXISTS actions_by_moderator ON actions (guild_id, moderator_id, id);
+CREATE INDEX IF NOT EXISTS actions_by_action ON actions (guild_id, action, id);
+CREATE VIRTUAL TABLE IF NOT EXISTS actions_fts USING fts5(
+    reason, context, user_name, moderator_name, content='actions', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS actions_index AFTER INSERT ON actions BEGIN
+    INSERT INTO actions_fts (rowid, reason, context, user_name, moderator_name)
+    VALUES (new.id, new.reason, new.context, new.user_name, new.moderator_name);
+END;
+CREATE TRIGGER IF NOT EXISTS actions_no_update BEFORE UPDATE ON actions BEGIN
+    SELECT RAISE(ABORT, 'the moderation log is append-only');
+END;
+CREATE TRIGGER IF NOT EXISTS actions_no_delete BEFORE DELETE ON actions BEGIN
+    SELECT RAISE(ABORT, 'the moderation log is append-only');
+END;
+"""
+
+class ModLog:
+    """Append-only moderation log in SQLite with an FTS5 index over reasons and context.
+
+    Every database call runs on one dedicated thread, so the connection is never
+    shared and the event loop never waits on disk. Actions are buffered in memory
+    and written in batches, one transaction per batch. Results are paginated by
+    keyset on the row id, so later pages cost the same as the first.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="modlog")
+        self._connection = None
+        self._pending = []
+        self._flush_handle = None
+        self._flush_task = None
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(MODLOG_SCHEMA)
+        return self._connection
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def record(self, guild_id, action, moderator, user=None, channel_id=None, reason=None, context=""):
+        """Queue a moderation action; it is written in the next batch."""
+        self._pending.append((
+            time.time(), guild_id, action,
+            user.id if user else None, str(user) if user else "",
+            moderator.id, str(moderator), channel_id, reason or "", context
+        ))
+        if len(self._pending) >= MODLOG_BATCH_SIZE:
+            self._start_flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(MODLOG_FLUSH_INTERVAL, self._start_flush)
+
+    def _start_flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._pending:
+            batch, self._pending = self._pending, []
+            # Submitted now rather than from a task, so a search issued right after queues behind it
+            self._flush_task = asyncio.get_running_loop().run_in_executor(self._executor, self._write, batch)
+            self._flush_task.add_done_callback(lambda future: self._flush_done(future, batch))
+
+    def _flush_done(self, future, batch):
+        if future.cancelled() or future.exception() is None:
+            return
+        # The failed transaction was rolled back, so the batch can be retried as is
+        logger.error("Error writing %d moderation log entries, will retry: %s", len(batch), future.exception())
+        self._pending[:0] = batch
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(MODLOG_FLUSH_INTERVAL, self._start_flush)
+
+    def _write(self, batch):
+        connection = self._connect()
+        with connection:
+            connection.executemany(
+                "INSERT INTO actions (created_at, guild_id, action, user_id, user_name, moderator_id,"
+                " moderator_name, channel_id, reason, context) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                batch
+            )
+        metrics["bot_modlog_written_total"] += len(batch)
+
+    async def search(self, guild_id, user_id=None, moderator_id=None, action=None,
+                     since=None, until=None, text=None, before_id=None, limit=MODLOG_PAGE_SIZE):
+        """Return up to ``limit`` matching actions, newest first, older than ``before_id``."""
+        # The executor is FIFO, so pending writes land before the query runs
+        self._start_flush()
+        return await self._run(self._search, guild_id, user_id, moderator_id, action,
+                               since, until, text, before_id, limit)
+
+    def _search(self, guild_id, user_id, moderator_id, action, since, until, text, before_id, limit):
+        clauses = ["a.guild_id = ?"]
+        params = [guild_id]
+        for column, value in (("a.user_id", user_id), ("a.moderator_id", moderator_id), ("a.action", action)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            clauses.append("a.created_at >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("a.created_at < ?")
+            params.append(until)
+        if before_id is not None:
+            clauses.append("a.id < ?")
+            params.append(before_id)
+
+        if text:
+            # Quote each word so punctuation in user input can't break the FTS5 query syntax
+            match = " ".join('"' + word.replace('"', '""') + '"' for word in text.split())
+            sql = ("SELECT a.* FROM actions_fts JOIN actions a ON a.id = actions_fts.rowid "
+                   f"WHERE actions_fts MATCH ? AND {' AND '.join(clauses)} ORDER BY a.id DESC LIMIT ?")
+            params = [match, *params, limit]
+        else:
+            sql = f"SELECT a.* FROM actions a WHERE {' AND '.join(clauses)} ORDER BY a.id DESC LIMIT ?"
+            params.append(limit)
+
+        connection = self._connect()
+        connection.row_factory = sqlite3.Row
+        return [dict(row) for row in connection.execute(sql, params)]
+
+    async def close(self):
+        self._start_flush()
+        if self._flush_task is not None:
+            try:
+                await self._flush_task
+            except Exception:
+                pass  # Already logged by _flush_done
+            if self._flush_handle is not None:
+                self._flush_handle.cancel()
+                self._flush_handle = None
+        await self._run(lambda: self._connection and self._connection.close())
+        self._executor.shutdown()
+
+def parse_duration(text):
+    """Parse durations like `30m`, `2h` or `7d` into a timedelta, or None if invalid."""
+    match = re.fullmatch(r"(\d+)([smhdw])", text.lower())
+    if not match:
+        return None
+    units = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days", "w": "weeks"}
+    return datetime.timedelta(**{units[match.group(2)]: int(match.group(1))})
+
+def parse_time_bound(text):
+    """A duration ago (`7d`) or an ISO date (`2024-01-31`) as a UNIX timestamp, or None."""
+    duration = parse_duration(text)
+    if duration is not None:
+        return time.time() - duration.total_seconds()
+    try:
+        return datetime.datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        return None
+
+class ModLogView(discord.ui.View):
+    """Older/Newer buttons for a `modlog` result, keyed on the row id of each page."""
+
+    def __init__(self, modlog, author_id, filters, rows):
+        super().__init__(timeout=300)
+        self.modlog = modlog
+        self.author_id = author_id
+        self.filters = filters
+        self.rows = rows
+        self.cursors = [None]  # before_id for each page shown so far
+        self._update_buttons()
+
+    def embed(self):
+        embed = discord.Embed(title="🛡️ Moderation Log", color=discord.Color.dark_red())
+        if not self.rows:
+            embed.description = "No matching actions."
+        for row in self.rows:
+            target = f" • {row['user_name']}" if row["user_name"] else ""
+            value = f"by {row['moderator_name']} • <t:{int(row['created_at'])}:f>"
+            if row["reason"]:
+                value += f"\nReason: {row['reason'][:200]}"
+            if row["context"]:
+                value += f"\n{row['context'][:200]}"
+            embed.add_field(name=f"#{row['id']} {row['action'].upper()}{target}", value=value, inline=False)
+        embed.set_footer(text=f"Page {len(self.cursors)}")
+        return embed
+
+    def _update_buttons(self):
+        self.newer.disabled = len(self.cursors) == 1
+        self.older.disabled = len(self.rows) < MODLOG_PAGE_SIZE
+
+    async def interaction_check(self, interaction):
+        return interaction.user.id == self.author_id
+
+    async def _show(self, interaction):
+        self.rows = await self.modlog.search(**self.filters, before_id=self.cursors[-1])
+        self._update_buttons()
+        await interaction.response.edit_message(embed=self.embed(), view=self)
+
+    @discord.ui.button(label="◀ Newer", style=discord.ButtonStyle.secondary)
+    async def newer(self, interaction, button):
+        self.cursors.pop()
+        await self._show(interaction)
+
+    @discord.ui.button(label="Older ▶", style=discord.ButtonStyle.secondary)
+    async def older(self, interaction, button):
+        self.cursors.append(self.rows[-1]["id"])
+        await self._show(interaction)
+
+# Bulk role jobs; checkpointed here so a restart resumes where it stopped
+MASSROLE_FILE = os.getenv("MASSROLE_FILE", "massrole_jobs.json")
+# Members handled between checkpoints
+MASSROLE_CHUNK = 100
+# Discord's role-edit bucket is per guild; stay just under it so edits never hit 429s
+MASSROLE_EDIT_LIMIT = (10, 10)
+MASSROLE_PROGRESS_INTERVAL = 5
+
+def member_matches(member, spec):
+    """Whether a member passes a `massrole` filter spec."""
+    role_ids = {role.id for role in member.roles}
+    joined = member.joined_at.timestamp() if member.joined_at else None
+    return (
+        all(role_id in role_ids for role_id in spec["has"])
+        and not any(role_id in role_ids for role_id in spec["lacks"])
+        and (spec["before"] is None or joined is not None and joined < spec["before"])
+        and (spec["after"] is None or joined is not None and joined >= spec["after"])
+        and (spec["bots"] is None or member.bot == spec["bots"])
+    )
+
 class ModerationCog(commands.Cog):
+    logger = logging.getLogger("algobot.moderation")
+
     def __init__(self, bot):
         self.bot = bot
+        self.modlog = ModLog(MODLOG_DB)
         self.warns = {}
         # Load warnings from file if it exists
         try:
@@ -294,22 +1552,148 @@ class ModerationCog(commands.Cog):
                 self.warns = json.load(f)
         except FileNotFoundError:
             pass
+        self.massrole_tasks = {}  # guild_id -> running task
+        # guild_id (str) -> job, as checkpointed in MASSROLE_FILE
+        self.massrole_jobs = read_json(MASSROLE_FILE, {})
+        # Saves run on the default executor; one at a time so an older snapshot can't land last
+        self._massrole_save_lock = asyncio.Lock()
 
     def _save_warns(self):
         with open('warns.json', 'w') as f:
             json.dump(self.warns, f)
 
+    async def _save_massrole_jobs(self):
+        # Serialize off the loop; jobs only hold plain values, so a shallow copy per job is a stable snapshot
+        snapshot = {guild_id: dict(job) for guild_id, job in self.massrole_jobs.items()}
+        async with self._massrole_save_lock:
+            await self.bot.loop.run_in_executor(None, write_json_atomic, MASSROLE_FILE, snapshot)
+
+    async def cog_unload(self):
+        # Jobs stay checkpointed and resume on the next start
+        for task in self.massrole_tasks.values():
+            task.cancel()
+        await self.modlog.close()
+
+    def _record(self, ctx, action, user=None, reason=None, context=""):
+        self.modlog.record(ctx.guild.id, action, ctx.author, user=user, channel_id=ctx.channel.id,
+                           reason=reason, context=context)
+
+    def _can_act_on(self, ctx, member):
+        # Moderators may only act on members below their own top role
+        return ctx.author == ctx.guild.owner or member.top_role < ctx.author.top_role
+
+    @commands.command(name="kick")
+    @commands.guild_only()
+    @commands.has_permissions(kick_members=True)
+    async def kick(self, ctx, member: discord.Member, *, reason=None):
+        """Kick a member"""
+        if not self._can_act_on(ctx, member):
+            return await ctx.send("You can't kick someone with an equal or higher role.")
+        try:
+            await member.kick(reason=reason)
+            self._record(ctx, "kick", member, reason)
+            await ctx.send(f"👢 Kicked {member}." + (f" Reason: {reason}" if reason else ""))
+        except discord.Forbidden:
+            await ctx.send("I don't have permission to kick that member.")
+
+    @commands.command(name="ban")
+    @commands.guild_only()
+    @commands.has_permissions(ban_members=True)
+    async def ban(self, ctx, member: discord.Member, *, reason=None):
+        """Ban a member"""
+        if not self._can_act_on(ctx, member):
+            return await ctx.send("You can't ban someone with an equal or higher role.")
+        try:
+            await member.ban(reason=reason, delete_message_seconds=0)
+            self._record(ctx, "ban", member, reason)
+            await ctx.send(f"🔨 Banned {member}." + (f" Reason: {reason}" if reason else ""))
+        except discord.Forbidden:
+            await ctx.send("I don't have permission to ban that member.")
+
+    @commands.command(name="warn")
+    @commands.guild_only()
+    @commands.has_permissions(kick_members=True)
+    async def warn(self, ctx, member: discord.Member, *, reason=None):
+        """Warn a member"""
+        warnings = self.warns.setdefault(str(ctx.guild.id), {}).setdefault(str(member.id), [])
+        warnings.append({
+            "reason": reason or "No reason given",
+            "moderator_id": ctx.author.id,
+            "time": datetime.datetime.now().isoformat()
+        })
+        self._save_warns()
+        self._record(ctx, "warn", member, reason, context=f"Warning #{len(warnings)}")
+        await ctx.send(f"⚠️ {member.mention} has been warned. They now have {len(warnings)} warning(s).")
+
+    @commands.command(name="warnings")
+    @commands.guild_only()
+    async def warnings(self, ctx, member: discord.Member):
+        """View a member's warnings"""
+        warnings = self.warns.get(str(ctx.guild.id), {}).get(str(member.id), [])
+        if not warnings:
+            return await ctx.send(f"{member} has no warnings.")
+        
+        embed = discord.Embed(title=f"Warnings for {member}", color=discord.Color.orange())
+        for i, warning in enumerate(warnings[-10:], max(1, len(warnings) - 9)):
+            embed.add_field(
+                name=f"#{i} • {warning['time'].split('T')[0]}",
+                value=f"{warning['reason']}\nBy <@{warning['moderator_id']}>",
+                inline=False
+            )
+        await ctx.send(embed=embed)
+
+    @commands.command(name="clearwarns")
+    @commands.guild_only()
+    @commands.has_permissions(kick_members=True)
+    async def clearwarns(self, ctx, member: discord.Member):
+        """Clear a member's warnings"""
+        cleared = self.warns.get(str(ctx.guild.id), {}).pop(str(member.id), [])
+        self._save_warns()
+        self._record(ctx, "clearwarns", member, context=f"Cleared {len(cleared)} warning(s)")
+        await ctx.send(f"Cleared {len(cleared)} warning(s) for {member}.")
+
+    @commands.command(name="modlog")
+    @commands.guild_only()
+    @commands.has_permissions(kick_members=True)
+    async def modlog_command(self, ctx, *, query: str = ""):
+        """Search the moderation log, e.g. `!modlog user:@someone action:ban since:7d spam`"""
+        filters = {"guild_id": ctx.guild.id}
+        words = []
+        for token in query.split():
+            key, _, value = token.partition(":")
+            key = key.lower()
+            if value and key in ("user", "mod"):
+                match = re.search(r"\d{15,20}", value)
+                if not match:
+                    return await ctx.send(f"Couldn't read a user from `{token}`. Use a mention or an ID.")
+                filters["user_id" if key == "user" else "moderator_id"] = int(match.group())
+            elif value and key == "action":
+                filters["action"] = value.lower()
+            elif value and key in ("since", "until"):
+                bound = parse_time_bound(value)
+                if bound is None:
+                    return await ctx.send(f"Couldn't read a time from `{token}`. Use e.g. `7d` or `2024-01-31`.")
+                filters[key] = bound
+            else:
+                words.append(token)
+        if words:
+            filters["text"] = " ".join(words)
+        
+        rows = await self.modlog.search(**filters)
+        view = ModLogView(self.modlog, ctx.author.id, filters, rows)
+        await ctx.send(embed=view.embed(), view=view)
+
     @commands.command(name="clear")
     @commands.has_permissions(manage_messages=True)
     async def clear(self, ctx, amount: int):
-        if amount >= 10:
-            amount = 10
+        amount = min(amount, guild_settings.get(ctx.guild.id)["clear_limit"])
         try:
             deleted = await ctx.channel.purge(limit=amount)
+            self._record(ctx, "clear", context=f"Deleted {len(deleted)} messages in #{ctx.channel}")
             await ctx.send(f"Cleared {len(deleted)} messages.", delete_after=5)
         except Exception as e:
             await ctx.send("An error occurred while trying to clear messages.")
-            logger.error(f"Error in clear command: {e}")
+            self.logger.error("Error in clear command: %s", e, extra=log_context(ctx))
      
     @commands.command(name="announcement")
     @commands.has_permissions(administrator=True)
@@ -323,31 +1707,33 @@ class ModerationCog(commands.Cog):
             )
             embed.set_footer(text=f"Announced by {ctx.author} | {datetime.datetime.now().strftime('%Y-%m-%d %H:%M')}")
             
-            # Send the announcement
-            sent_message = await channel.send(embed=embed)
-            
-            # Option to add a ping
-            await ctx.send(f"Announcement posted in {channel.mention}. Would you like to add a ping? Reply with: `everyone`, `here`, `role @role`, or `none`")
+            # Ask for the ping first so the announcement and its ping go out as a single message
+            await ctx.send(f"Would you like to add a ping to the announcement in {channel.mention}? Reply with: `everyone`, `here`, `role @role`, or `none`")
             
             def check(m):
                 return m.author == ctx.author and m.channel == ctx.channel
             
+            ping = None
+            allowed_mentions = discord.AllowedMentions.none()
             try:
                 reply = await bot.wait_for('message', check=check, timeout=30.0)
                 
                 if reply.content.lower() == 'everyone':
-                    await channel.send("@everyone", allowed_mentions=discord.AllowedMentions(everyone=True))
+                    ping = "@everyone"
+                    allowed_mentions = discord.AllowedMentions(everyone=True)
                 elif reply.content.lower() == 'here':
-                    await channel.send("@here", allowed_mentions=discord.AllowedMentions(everyone=True))
+                    ping = "@here"
+                    allowed_mentions = discord.AllowedMentions(everyone=True)
                 elif reply.content.lower().startswith('role '):
                     # Extract role mention
                     try:
-                        role_id = int(reply.content.split('@')[1].split('>')[0])
+                        role_id = int(reply.content.split('@')[1].split('>')[0].lstrip('&'))
                         role = ctx.guild.get_role(role_id)
                         if role:
-                            await channel.send(f"{role.mention}", allowed_mentions=discord.AllowedMentions(roles=[role]))
+                            ping = role.mention
+                            allowed_mentions = discord.AllowedMentions(roles=[role])
                         else:
-                            await ctx.send("Role not found.")
+                            await ctx.send("Role not found. No ping added.")
                     except:
                         await ctx.send("Invalid role format. No ping added.")
                 elif reply.content.lower() != 'none':
@@ -356,20 +1742,450 @@ class ModerationCog(commands.Cog):
             except asyncio.TimeoutError:
                 await ctx.send("No ping option selected within the time limit.")
             
+            # Send the announcement
+            sent_message = await outbox.send(channel, ping, embed=embed, allowed_mentions=allowed_mentions)
+            if sent_message is None:
+                return await ctx.send("An error occurred while making the announcement.")
+            
+            self._record(ctx, "announcement", context=f"#{channel} {ping or ''}\n{message}")
+            await ctx.send(f"Announcement posted in {channel.mention}.")
             await ctx.send("Announcement process completed.")
             
         except Exception as e:
             await ctx.send("An error occurred while making the announcement.")
-            logger.error(f"Error in announcement command: {e}")
+            self.logger.error("Error in announcement command: %s", e, extra=log_context(ctx))
+
+    @commands.group(name="massrole")
+    @commands.guild_only()
+    @commands.has_permissions(manage_roles=True)
+    @commands.bot_has_permissions(manage_roles=True)
+    async def massrole(self, ctx):
+        """Add or remove a role for every member matching a filter"""
+        # Not invoke_without_command, so the permission checks above also guard every subcommand
+        if ctx.invoked_subcommand is None:
+            await ctx.send(
+                "Usage: `!massrole add|remove <role> <filters>` with filters `all`, `has:@role`, `lacks:@role`, "
+                "`before:<date|7d>`, `after:<date|7d>`, `bots` or `humans`. Also `!massrole status` and `!massrole cancel`."
+            )
+
+    @massrole.command(name="add")
+    async def massrole_add(self, ctx, role: discord.Role, *filters: str):
+        """Give a role to every matching member, e.g. `!massrole add @Veteran before:2024-01-01`"""
+        await self._start_massrole(ctx, "add", role, filters)
+
+    @massrole.command(name="remove")
+    async def massrole_remove(self, ctx, role: discord.Role, *filters: str):
+        """Take a role from every matching member, e.g. `!massrole remove @Trial has:@Member`"""
+        await self._start_massrole(ctx, "remove", role, filters)
+
+    @massrole.command(name="status")
+    async def massrole_status(self, ctx):
+        job = self.massrole_jobs.get(str(ctx.guild.id))
+        if job is None:
+            return await ctx.send("No mass role job is running.")
+        await ctx.send(embed=self._massrole_embed(ctx.guild, job))
+
+    @massrole.command(name="cancel")
+    async def massrole_cancel(self, ctx):
+        job = self.massrole_jobs.pop(str(ctx.guild.id), None)
+        if job is None:
+            return await ctx.send("No mass role job is running.")
+        task = self.massrole_tasks.pop(ctx.guild.id, None)
+        if task is not None:
+            task.cancel()
+        await self._save_massrole_jobs()
+        job["status"] = "cancelled"
+        self._record(ctx, "massrole_cancel", context=f"{job['action']} role {job['role_id']} after {job['changed']} changes")
+        await ctx.send(embed=self._massrole_embed(ctx.guild, job))
+
+    async def _start_massrole(self, ctx, action, role, filters):
+        if str(ctx.guild.id) in self.massrole_jobs:
+            return await ctx.send("A mass role job is already running here. Check it with `!massrole status` or stop it with `!massrole cancel`.")
+        if role.is_default() or role.managed:
+            return await ctx.send("That role can't be assigned by hand.")
+        if role >= ctx.guild.me.top_role or (ctx.author != ctx.guild.owner and role >= ctx.author.top_role):
+            return await ctx.send("That role is above my highest role or yours.")
+        
+        spec = {"has": [], "lacks": [], "before": None, "after": None, "bots": None}
+        for token in filters:
+            key, _, value = token.partition(":")
+            key = key.lower()
+            if key in ("all", "bots", "humans") and not value:
+                if key != "all":
+                    spec["bots"] = key == "bots"
+            elif value and key in ("has", "lacks"):
+                spec[key].append((await commands.RoleConverter().convert(ctx, value)).id)
+            elif value and key in ("before", "after"):
+                spec[key] = parse_time_bound(value)
+                if spec[key] is None:
+                    return await ctx.send(f"Couldn't read a time from `{token}`. Use e.g. `30d` or `2024-01-31`.")
+            else:
+                return await ctx.send(f"Unknown filter `{token}`. Use `all`, `has:`, `lacks:`, `before:`, `after:`, `bots` or `humans`.")
+        if not filters:
+            return await ctx.send("Add a filter, or `all` to include every member.")
+        
+        job = {
+            "action": action, "role_id": role.id, "spec": spec, "filters": " ".join(filters),
+            "channel_id": ctx.channel.id, "message_id": None, "moderator": str(ctx.author),
+            "cursor": 0, "scanned": 0, "changed": 0, "failed": 0,
+            "started_at": time.time(), "status": "running",
+        }
+        message = await ctx.send(embed=self._massrole_embed(ctx.guild, job))
+        job["message_id"] = message.id
+        self.massrole_jobs[str(ctx.guild.id)] = job
+        await self._save_massrole_jobs()
+        self._record(ctx, f"massrole_{action}", context=f"Role {role.name} ({role.id}); filters: {job['filters']}")
+        self.massrole_tasks[ctx.guild.id] = asyncio.create_task(self._run_massrole(ctx.guild, job))
+
+    def resume_massrole_jobs(self):
+        """Restart checkpointed jobs for guilds the bot can see. Called from on_ready."""
+        for guild_id, job in self.massrole_jobs.items():
+            guild = self.bot.get_guild(int(guild_id))
+            if guild is not None and guild.id not in self.massrole_tasks:
+                self.logger.info("Resuming mass role job after member %s", job["cursor"], extra={"guild": guild.id})
+                self.massrole_tasks[guild.id] = asyncio.create_task(self._run_massrole(guild, job))
+
+    async def _run_massrole(self, guild, job):
+        role = guild.get_role(job["role_id"])
+        channel = guild.get_channel(job["channel_id"])
+        progress = channel.get_partial_message(job["message_id"]) if channel and job["message_id"] else None
+        last_update, last_changed = time.monotonic(), job["changed"]
+        
+        async def report(force=False):
+            nonlocal last_update, last_changed
+            now = time.monotonic()
+            if progress is None or (not force and now - last_update < MASSROLE_PROGRESS_INTERVAL):
+                return
+            job["rate"] = (job["changed"] - last_changed) / max(now - last_update, 1e-9)
+            last_update, last_changed = now, job["changed"]
+            try:
+                await progress.edit(embed=self._massrole_embed(guild, job))
+            except discord.HTTPException as e:
+                self.logger.warning("Couldn't update mass role progress: %s", e, extra={"guild": guild.id})
+        
+        try:
+            if role is None:
+                job["status"] = "role deleted"
+            else:
+                reason = f"massrole by {job['moderator']}: {job['filters']}"[:512]
+                since_checkpoint = 0
+                # Member pages come back in ascending ID order, so the last handled ID is a resumable cursor
+                async for member in guild.fetch_members(limit=None, after=discord.Object(id=job["cursor"])):
+                    has_role = member.get_role(role.id) is not None
+                    if has_role != (job["action"] == "add") and member_matches(member, job["spec"]):
+                        await self._wait_for_role_bucket(guild.id)
+                        try:
+                            if job["action"] == "add":
+                                await member.add_roles(role, reason=reason)
+                            else:
+                                await member.remove_roles(role, reason=reason)
+                            job["changed"] += 1
+                            metrics["bot_massrole_edits_total"] += 1
+                        except discord.NotFound:
+                            pass  # Left the guild since the page was fetched
+                        except discord.Forbidden:
+                            job["failed"] += 1
+                    job["cursor"] = member.id
+                    job["scanned"] += 1
+                    since_checkpoint += 1
+                    if since_checkpoint >= MASSROLE_CHUNK:
+                        since_checkpoint = 0
+                        await self._save_massrole_jobs()
+                    await report()
+                job["status"] = "done"
+        except Exception as e:
+            job["status"] = "failed"
+            self.logger.error("Mass role job failed: %s", e, extra={"guild": guild.id})
+        finally:
+            if job["status"] != "running":
+                if self.massrole_jobs.get(str(guild.id)) is job:
+                    del self.massrole_jobs[str(guild.id)]
+                self.massrole_tasks.pop(guild.id, None)
+            await self._save_massrole_jobs()
+        await report(force=True)
+
+    async def _wait_for_role_bucket(self, guild_id):
+        # Shares the dispatcher's limiter so role edits and messages count against the same global budget
+        while True:
+            retry_after, _ = outbox.limiter.acquire([
+                (("massrole", guild_id), *MASSROLE_EDIT_LIMIT),
+                (("global",), *GLOBAL_SEND_LIMIT),
+            ])
+            if not retry_after:
+                return
+            await asyncio.sleep(retry_after)
+
+    def _massrole_embed(self, guild, job):
+        role = guild.get_role(job["role_id"])
+        elapsed = max(time.time() - job["started_at"], 1e-9)
+        colors = {"running": discord.Color.blue(), "done": discord.Color.green()}
+        embed = discord.Embed(
+            title=f"🏷️ Mass role {job['action']}: {role.name if role else job['role_id']}",
+            description=f"Filters: `{job['filters']}`",
+            color=colors.get(job["status"], discord.Color.red())
+        )
+        total = guild.member_count or 0
+        percent = f" ({min(job['scanned'] / total, 1):.0%})" if total else ""
+        embed.add_field(name="Scanned", value=f"{job['scanned']:,} / {total:,}{percent}")
+        embed.add_field(name="Changed", value=f"{job['changed']:,}")
+        embed.add_field(name="Failed", value=f"{job['failed']:,}")
+        embed.add_field(name="Throughput", value=f"{job.get('rate', 0):.1f}/s now • {job['changed'] / elapsed:.1f}/s average")
+        embed.add_field(name="Status", value=job["status"].capitalize())
+        embed.set_footer(text="Progress is checkpointed; a restart resumes where the job stopped.")
+        return embed
+
+    @commands.group(name="config")
+    @commands.guild_only()
+    @commands.has_permissions(administrator=True)
+    async def config(self, ctx):
+        """Show or change this server's settings (Admin only)"""
+        # Not invoke_without_command, so the admin check above also guards every subcommand
+        if ctx.invoked_subcommand is not None:
+            return
+        settings = guild_settings.get(ctx.guild.id)
+        welcome_channel = ctx.guild.get_channel(settings["welcome_channel_id"] or 0)
+        embed = discord.Embed(title=f"⚙️ Settings for {ctx.guild.name}", color=discord.Color.blue())
+        embed.add_field(name="Prefix", value=f"`{settings['prefix']}`")
+        embed.add_field(name="Clear Limit", value=settings["clear_limit"])
+        embed.add_field(
+            name="Welcome",
+            value="Off" if not settings["welcome_enabled"] else (welcome_channel.mention if welcome_channel else "System channel")
+        )
+        embed.add_field(name="Disabled Cogs", value=", ".join(settings["disabled_cogs"]) or "None")
+        signal_channel = ctx.guild.get_channel(settings["signal_channel_id"] or 0)
+        embed.add_field(name="Signals", value=signal_channel.mention if signal_channel else "Off")
+        embed.add_field(name="Meme Feeds", value=", ".join(f"r/{name}" for name in settings["subreddits"]), inline=False)
+        embed.set_footer(text=f"Change with {settings['prefix']}config <prefix|welcome|clearlimit|feeds|cog|signals|reset>")
+        await ctx.send(embed=embed)
+
+    @config.command(name="prefix")
+    async def config_prefix(self, ctx, prefix: str):
+        if len(prefix) > 5:
+            return await ctx.send("The prefix can be at most 5 characters.")
+        guild_settings.set(ctx.guild.id, "prefix", prefix)
+        await ctx.send(f"Prefix set to `{prefix}`.")
+
+    @config.command(name="welcome")
+    async def config_welcome(self, ctx, value: str):
+        """`on`, `off`, or a channel to send welcomes to"""
+        if value.lower() in ("on", "off"):
+            guild_settings.set(ctx.guild.id, "welcome_enabled", value.lower() == "on")
+            return await ctx.send(f"Welcome messages turned {value.lower()}.")
+        channel = await commands.TextChannelConverter().convert(ctx, value)
+        guild_settings.set(ctx.guild.id, "welcome_channel_id", channel.id)
+        guild_settings.set(ctx.guild.id, "welcome_enabled", True)
+        await ctx.send(f"Welcome messages will be posted in {channel.mention}.")
+
+    @config.command(name="clearlimit")
+    async def config_clearlimit(self, ctx, limit: int):
+        if not 1 <= limit <= 100:
+            return await ctx.send("The clear limit must be between 1 and 100.")
+        guild_settings.set(ctx.guild.id, "clear_limit", limit)
+        await ctx.send(f"`clear` will now delete at most {limit} messages.")
+
+    @config.command(name="feeds")
+    async def config_feeds(self, ctx, action: str, subreddit: str):
+        """`add` or `remove` a subreddit used by `stonks`"""
+        subreddits = list(guild_settings.get(ctx.guild.id)["subreddits"])
+        subreddit = subreddit.lower().removeprefix("r/")
+        if action == "add" and subreddit not in subreddits:
+            subreddits.append(subreddit)
+        elif action == "remove" and subreddit in subreddits:
+            if len(subreddits) == 1:
+                return await ctx.send("At least one feed is required.")
+            subreddits.remove(subreddit)
+        elif action not in ("add", "remove"):
+            return await ctx.send("Use `add` or `remove`.")
+        guild_settings.set(ctx.guild.id, "subreddits", subreddits)
+        await ctx.send(f"Meme feeds: {', '.join(f'r/{name}' for name in subreddits)}")
+
+    @config.command(name="cog")
+    async def config_cog(self, ctx, action: str, name: str):
+        """`enable` or `disable` a group of commands, e.g. `music`"""
+        name = name.lower().removesuffix("cog")
+        cogs = {cog.qualified_name.removesuffix("Cog").lower() for cog in self.bot.cogs.values()}
+        if name not in cogs:
+            return await ctx.send(f"Unknown cog '{name}'. Choose from: {', '.join(sorted(cogs))}")
+        if name in REQUIRED_COGS:
+            return await ctx.send(f"The {name} commands can't be disabled.")
+        
+        disabled = set(guild_settings.get(ctx.guild.id)["disabled_cogs"])
+        if action == "enable":
+            disabled.discard(name)
+        elif action == "disable":
+            disabled.add(name)
+        else:
+            return await ctx.send("Use `enable` or `disable`.")
+        guild_settings.set(ctx.guild.id, "disabled_cogs", sorted(disabled))
+        await ctx.send(f"The {name} commands are now {action}d.")
+
+    @config.command(name="signals")
+    async def config_signals(self, ctx, value: str):
+        """A channel to post watchlist signals to, or `off`"""
+        if value.lower() == "off":
+            guild_settings.set(ctx.guild.id, "signal_channel_id", None)
+            return await ctx.send("Watchlist signals turned off.")
+        channel = await commands.TextChannelConverter().convert(ctx, value)
+        guild_settings.set(ctx.guild.id, "signal_channel_id", channel.id)
+        await ctx.send(f"Watchlist signals will be posted in {channel.mention}.")
+
+    @config.command(name="reset")
+    async def config_reset(self, ctx, key: str):
+        """Reset one setting to its default"""
+        keys = {"prefix": ["prefix"], "welcome": ["welcome_enabled", "welcome_channel_id"],
+                "clearlimit": ["clear_limit"], "feeds": ["subreddits"], "cog": ["disabled_cogs"],
+                "signals": ["signal_channel_id"]}
+        if key not in keys:
+            return await ctx.send(f"Unknown setting. Choose from: {', '.join(keys)}")
+        for setting in keys[key]:
+            guild_settings.set(ctx.guild.id, setting, DEFAULT_GUILD_SETTINGS[setting])
+        await ctx.send(f"`{key}` reset to its default.")
+
+# --- Usage Statistics ---
+STATS_DB = os.getenv("STATS_DB", "stats.db")
+STATS_FLUSH_INTERVAL = 30
+STATS_COMPACT_INTERVAL = 3600
+# Queries read the finest rollup that covers their period in at most this many buckets
+STATS_MAX_BUCKETS = 1440
+# Seconds per bucket for each rollup table and how long its buckets are kept (None keeps them forever)
+STATS_ROLLUPS = {"minute": (60, 2 * 86400), "hour": (3600, 90 * 86400), "day": (86400, None)}
+STATS_PERIODS = {"1h": 3600, "24h": 86400, "7d": 7 * 86400, "30d": 30 * 86400, "all": None}
+# Commands whose invokers count as music requesters
+MUSIC_REQUEST_COMMANDS = ("play",)
+STATS_SCHEMA = "".join(f"""
+CREATE TABLE IF NOT EXISTS usage_{name} (
+    guild_id INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    command TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    uses INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, bucket, command, user_id)
+) WITHOUT ROWID;
+""" for name in STATS_ROLLUPS)
+
+class UsageStats:
+    """Per-guild command counts rolled up into minute, hour and day tables in SQLite.
+
+    ``increment`` only bumps an in-memory Counter. Every flush adds the counts to
+    all three rollups in one transaction, so a query reads the coarsest table
+    that still covers its period instead of scanning raw events. Minute and hour
+    buckets are deleted once they age past their retention. Like ``ModLog``, all
+    database work runs on one dedicated thread.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stats")
+        self._connection = None
+        self._pending = Counter()  # (guild_id, minute, command, user_id) -> uses
+        self._compacted_at = 0
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(STATS_SCHEMA)
+        return self._connection
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def increment(self, guild_id, command, user_id):
+        minute = int(time.time()) // 60 * 60
+        self._pending[(guild_id, minute, command.qualified_name, user_id)] += 1
+
+    async def flush(self):
+        """Write pending counts into every rollup and compact expired buckets."""
+        batch, self._pending = self._pending, Counter()
+        await self._run(self._write, batch, time.time())
+
+    def _write(self, batch, now):
+        connection = self._connect()
+        with connection:
+            for name, (size, retention) in STATS_ROLLUPS.items():
+                if batch:
+                    connection.executemany(
+                        f"INSERT INTO usage_{name} (guild_id, bucket, command, user_id, uses) VALUES (?, ?, ?, ?, ?) "
+                        "ON CONFLICT DO UPDATE SET uses = uses + excluded.uses",
+                        [(guild_id, minute // size * size, command, user_id, uses)
+                         for (guild_id, minute, command, user_id), uses in batch.items()]
+                    )
+                if retention is not None and now - self._compacted_at >= STATS_COMPACT_INTERVAL:
+                    connection.execute(f"DELETE FROM usage_{name} WHERE bucket < ?", (now - retention,))
+        if now - self._compacted_at >= STATS_COMPACT_INTERVAL:
+            self._compacted_at = now
+        metrics["bot_stats_flushed_total"] += sum(batch.values())
+
+    async def summary(self, guild_id, period):
+        """Totals, top commands, top users, uses per UTC hour and top music requesters since ``period`` seconds ago."""
+        batch, self._pending = self._pending, Counter()
+        return await self._run(self._summary, batch, guild_id, period, time.time())
+
+    def _summary(self, batch, guild_id, period, now):
+        # Flush first so the counts include the last few seconds
+        self._write(batch, now)
+        name = next(name for name, (size, retention) in STATS_ROLLUPS.items()
+                    if retention is None or period is not None and period <= retention and period / size <= STATS_MAX_BUCKETS)
+        # Round down to a bucket boundary; `7d` from the hour table may include up to an extra hour
+        size = STATS_ROLLUPS[name][0]
+        since = 0 if period is None else int(now - period) // size * size
+        connection = self._connect()
+        where = f"FROM usage_{name} WHERE guild_id = ? AND bucket >= ?"
+
+        def rows(sql, *params):
+            return connection.execute(sql, (guild_id, since, *params)).fetchall()
+
+        total = rows(f"SELECT COALESCE(SUM(uses), 0) {where}")[0][0]
+        top_commands = rows(f"SELECT command, SUM(uses) AS n {where} GROUP BY command ORDER BY n DESC LIMIT 5")
+        top_users = rows(f"SELECT user_id, SUM(uses) AS n {where} GROUP BY user_id ORDER BY n DESC LIMIT 5")
+        placeholders = ", ".join("?" for _ in MUSIC_REQUEST_COMMANDS)
+        requesters = rows(f"SELECT user_id, SUM(uses) AS n {where} AND command IN ({placeholders}) "
+                          "GROUP BY user_id ORDER BY n DESC LIMIT 5", *MUSIC_REQUEST_COMMANDS)
+        # Hour of day needs hourly buckets, so it reads the hour rollup within its retention
+        hour_since = max(since, now - STATS_ROLLUPS["hour"][1])
+        hours = [0] * 24
+        for hour, uses in connection.execute(
+            "SELECT (bucket / 3600) % 24, SUM(uses) FROM usage_hour WHERE guild_id = ? AND bucket >= ? GROUP BY 1",
+            (guild_id, hour_since // 3600 * 3600)
+        ):
+            hours[hour] = uses
+        return {"total": total, "commands": top_commands, "users": top_users, "hours": hours, "requesters": requesters}
+
+    async def close(self):
+        await self.flush()
+        await self._run(lambda: self._connection and self._connection.close())
+        self._connection = None
+
+usage_stats = UsageStats(STATS_DB)
+
+@tasks.loop(seconds=STATS_FLUSH_INTERVAL)
+async def flush_usage_stats():
+    try:
+        await usage_stats.flush()
+    except Exception as e:
+        logger.error("Error flushing usage statistics: %s", e)
+
+def sparkline(values):
+    """Render numbers as a row of block characters scaled to the largest value."""
+    blocks = "▁▂▃▄▅▆▇█"
+    peak = max(values) or 1
+    return "".join(blocks[round(value / peak * (len(blocks) - 1))] for value in values)
 
 # --- Utility Commands ---
+POLL_EMOJIS = ["1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣", "6️⃣", "7️⃣", "8️⃣", "9️⃣", "🔟"]
+
 class UtilityCog(commands.Cog):
+    logger = logging.getLogger("algobot.utility")
+
     def __init__(self, bot):
         self.bot = bot
         self.polls = {}
         self.reminders = []
         bot.remove_command("help")
 
+    async def cog_unload(self):
+        await usage_stats.close()
+
     @commands.command(name="help")
     async def help_command(self, ctx, category=None):
         """Display a detailed help menu with bot commands and usage instructions."""
@@ -424,6 +2240,47 @@ class UtilityCog(commands.Cog):
                     "announcement <channel> <message>": {
                         "description": "Post an announcement in the designated channel.",
                         "usage": "!announcement #general Important update!"
+                    },
+                    "kick <member> [reason]": {
+                        "description": "Kick a member from the server.",
+                        "usage": "!kick @username Spamming"
+                    },
+                    "ban <member> [reason]": {
+                        "description": "Ban a member from the server.",
+                        "usage": "!ban @username Raiding"
+                    },
+                    "warn <member> [reason]": {
+                        "description": "Give a member a warning. Use `!warnings` to view them and `!clearwarns` to reset them.",
+                        "usage": "!warn @username Please stay on topic"
+                    },
+                    "modlog [filters] [text]": {
+                        "description": (
+                            "Search moderation actions. Filter with `user:`, `mod:`, `action:`, "
+                            "`since:` and `until:`, and add words to search reasons."
+                        ),
+                        "usage": "!modlog action:ban since:30d spam"
+                    },
+                    "massrole <add|remove> <role> <filters>": {
+                        "description": (
+                            "Add or remove a role for every matching member in the background. Filter with "
+                            "`all`, `has:`, `lacks:`, `before:`, `after:`, `bots` or `humans`. "
+                            "Check on it with `massrole status` or stop it with `massrole cancel`."
+                        ),
+                        "usage": "!massrole add @Veteran before:2024-01-01 has:@Member"
+                    },
+                    "automod [on|off|actions|logchannel|unlock]": {
+                        "description": (
+                            "Configure spam, channel flood and raid detection and the actions they trigger "
+                            "(delete, timeout, slowmode, lockdown)."
+                        ),
+                        "usage": "!automod actions spam delete timeout"
+                    },
+                    "config [setting] [value]": {
+                        "description": (
+                            "Show or change this server's settings: prefix, welcome channel, "
+                            "clear limit, meme feeds, enabled cogs and the watchlist signal channel."
+                        ),
+                        "usage": "!config prefix ?"
                     }
                 }
             },
@@ -443,6 +2300,10 @@ class UtilityCog(commands.Cog):
                         "description": "Display detailed information about the server.",
                         "usage": "!serverinfo"
                     },
+                    "stats [period]": {
+                        "description": "Show the most used commands, most active users, busiest hours and top music requesters for 1h, 24h, 7d, 30d or all.",
+                        "usage": "!stats 30d"
+                    },
                     "userinfo [member]": {
                         "description": (
                             "Show detailed information about a user. "
@@ -488,6 +2349,32 @@ class UtilityCog(commands.Cog):
                         "usage": "!jpow"
                     }
                 }
+            },
+            "market": {
+                "emoji": "📈",
+                "title": "Market Commands",
+                "description": (
+                    "Keep an eye on real market data. Chart stocks with indicators, set price "
+                    "alerts and get pinged when a stock crosses your target."
+                ),
+                "commands": {
+                    "chart <symbol> [range] [indicators]": {
+                        "description": "Chart a stock's daily prices. Ranges: 1m, 3m, 6m, 1y, 2y, 5y, max. Indicators: sma, ema, bb (Bollinger) with a period. Add `line` or `candle` to pick the style.",
+                        "usage": "!chart AAPL 1y sma50 ema20 bb20"
+                    },
+                    "alert <symbol> <>|<> <price>": {
+                        "description": "Get pinged in this channel when a stock goes above (>) or below (<) a price.",
+                        "usage": "!alert TSLA > 300"
+                    },
+                    "alerts": {
+                        "description": "List your active price alerts.",
+                        "usage": "!alerts"
+                    },
+                    "unalert <id>": {
+                        "description": "Remove one of your price alerts.",
+                        "usage": "!unalert 12"
+                    }
+                }
             }
         }
 
@@ -553,12 +2440,35 @@ class UtilityCog(commands.Cog):
     @commands.command(name="poll")
     async def poll(self, ctx, question, *options):
         """Create a poll with reactions"""
-        if len(options) > 10:
-            return await ctx.send("You can only have up to 10 options.")
+        error = self._validate_poll_options(options)
+        if error:
+            return await ctx.send(error)
         
+        # Send poll
+        poll_message = await ctx.send(embed=self._poll_embed(question, options, ctx.author))
+        await self._start_poll(poll_message, question, options, ctx.channel.id, ctx.author.id)
+
+    @app_commands.command(name="poll", description="Create a poll with reactions")
+    @app_commands.describe(question="The poll question", options="Between 2 and 10 options separated by |")
+    @app_rate_limit()
+    async def poll_slash(self, interaction: discord.Interaction, question: str, options: str):
+        options = [option.strip() for option in options.split("|") if option.strip()]
+        error = self._validate_poll_options(options)
+        if error:
+            return await interaction.response.send_message(error, ephemeral=True)
+        
+        await interaction.response.send_message(embed=self._poll_embed(question, options, interaction.user))
+        poll_message = await interaction.original_response()
+        await self._start_poll(poll_message, question, options, interaction.channel_id, interaction.user.id)
+
+    def _validate_poll_options(self, options):
+        if len(options) > 10:
+            return "You can only have up to 10 options."
         if len(options) < 2:
-            return await ctx.send("You need at least 2 options.")
-        
+            return "You need at least 2 options."
+        return None
+
+    def _poll_embed(self, question, options, author):
         # Create embed
         embed = discord.Embed(
             title="📊 Poll",
@@ -567,29 +2477,26 @@ class UtilityCog(commands.Cog):
         )
         
         # Add options with emojis
-        emojis = ["1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣", "6️⃣", "7️⃣", "8️⃣", "9️⃣", "🔟"]
         option_text = ""
-        
         for i, option in enumerate(options):
-            option_text += f"{emojis[i]} {option}\n"
+            option_text += f"{POLL_EMOJIS[i]} {option}\n"
         
         embed.add_field(name="Options", value=option_text)
-        embed.set_footer(text=f"Poll by {ctx.author} | React to vote!")
-        
-        # Send poll
-        poll_message = await ctx.send(embed=embed)
-        
+        embed.set_footer(text=f"Poll by {author} | React to vote!")
+        return embed
+
+    async def _start_poll(self, poll_message, question, options, channel_id, author_id):
         # Add reactions
         for i in range(len(options)):
-            await poll_message.add_reaction(emojis[i])
+            await poll_message.add_reaction(POLL_EMOJIS[i])
         
         # Save poll data
         self.polls[str(poll_message.id)] = {
             "question": question,
             "options": list(options),
-            "emojis": emojis[:len(options)],
-            "channel_id": ctx.channel.id,
-            "author_id": ctx.author.id,
+            "emojis": POLL_EMOJIS[:len(options)],
+            "channel_id": channel_id,
+            "author_id": author_id,
             "created_at": datetime.datetime.now().isoformat()
         }
         self.save_data()
@@ -615,10 +2522,12 @@ class UtilityCog(commands.Cog):
         # Send reminders
         for reminder in reminders_to_send:
             try:
-                user = await self.bot.fetch_user(reminder["user_id"])
                 channel = self.bot.get_channel(reminder["channel_id"])
+                if channel is None:
+                    continue
+                user = await outbox.resolve_user(reminder["user_id"])
                 
-                if user and channel:
+                if user:
                     embed = discord.Embed(
                         title="⏰ Reminder",
                         description=reminder["reminder"],
@@ -626,9 +2535,10 @@ class UtilityCog(commands.Cog):
                     )
                     embed.set_footer(text="Reminder set on: " + reminder["reminder_time"].split("T")[0])
                     
-                    await channel.send(f"{user.mention}", embed=embed)
+                    # Queued rather than awaited so one slow channel doesn't hold up the rest
+                    outbox.send(channel, f"{user.mention}", embed=embed)
             except Exception as e:
-                logger.error(f"Error sending reminder: {e}")
+                self.logger.error("Error sending reminder: %s", e, extra={"channel": reminder["channel_id"], "user": reminder["user_id"]})
     
     @commands.command(name="serverinfo")
     async def serverinfo(self, ctx):
@@ -669,6 +2579,37 @@ class UtilityCog(commands.Cog):
         
         await ctx.send(embed=embed)
 
+    @commands.command(name="stats")
+    @commands.guild_only()
+    async def stats(self, ctx, period: str = "7d"):
+        """Show command usage for this server over `1h`, `24h`, `7d`, `30d` or `all`"""
+        period = period.lower()
+        if period not in STATS_PERIODS:
+            return await ctx.send(f"Choose a period from: {', '.join(STATS_PERIODS)}")
+        summary = await usage_stats.summary(ctx.guild.id, STATS_PERIODS[period])
+        if not summary["total"]:
+            return await ctx.send("No commands have been used here in that period.")
+        
+        def member_lines(rows):
+            return "\n".join(f"<@{user_id}> — {uses}" for user_id, uses in rows) or "None"
+        
+        hours = summary["hours"]
+        busiest = sorted(range(24), key=lambda hour: hours[hour], reverse=True)[:3]
+        embed = discord.Embed(
+            title=f"📊 Command Usage • {period}",
+            description=f"**{summary['total']:,}** commands used",
+            color=discord.Color.blue()
+        )
+        embed.add_field(name="Top Commands", value="\n".join(f"`{name}` — {uses}" for name, uses in summary["commands"]))
+        embed.add_field(name="Top Users", value=member_lines(summary["users"]))
+        embed.add_field(name="Top Music Requesters", value=member_lines(summary["requesters"]))
+        embed.add_field(
+            name="Busiest Hours (UTC)",
+            value=f"`{sparkline(hours)}`\n`00    06    12    18   23`\n" + ", ".join(f"{hour:02d}:00" for hour in busiest if hours[hour]),
+            inline=False
+        )
+        await ctx.send(embed=embed)
+
     @commands.command(name="userinfo")
     async def userinfo(self, ctx, member: discord.Member = None):
         """Display information about a user"""
@@ -734,43 +2675,68 @@ class UtilityCog(commands.Cog):
             await ctx.send(embed=embed)
 
 class FunCog(commands.Cog):
+    logger = logging.getLogger("algobot.fun")
+
     def __init__(self, bot):
         self.bot = bot
         
     @commands.command(name="stonks")
     async def stonks(self, ctx):
         """Fetches a random meme from r/wallstreetbets"""
-        subreddits = ["wallstreetbets", "investingmemes", "financememes", "algotrading", "options"]
-        subreddit = random.choice(subreddits)
-        
         try:
-            response = requests.get(f"https://www.reddit.com/r/{subreddit}/hot.json?limit=100", 
-                                   headers={"User-agent": "Discord Bot"})
-            data = response.json()
-            
-            posts = [post for post in data["data"]["children"] 
-                    if not post["data"]["is_self"] and not post["data"]["over_18"]]
-            
-            if not posts:
+            # requests is blocking, so keep it off the event loop
+            subreddits = guild_settings.get(ctx.guild.id)["subreddits"] if ctx.guild else DEFAULT_GUILD_SETTINGS["subreddits"]
+            embed = await self.bot.loop.run_in_executor(None, self._fetch_meme, subreddits)
+            if embed is None:
                 return await ctx.send("No tendies for you today. Try again when market opens. 📉")
-            
-            random_post = random.choice(posts)
-            post_data = random_post["data"]
-            
-            embed = discord.Embed(
-                title=post_data["title"],
-                url=f"https://reddit.com{post_data['permalink']}",
-                color=discord.Color.green() if random.random() > 0.5 else discord.Color.red()
-            )
-            
-            embed.set_image(url=post_data["url"])
-            embed.set_footer(text=f"💎👐 {post_data['ups']} | 🦍 {post_data['num_comments']} | From r/{subreddit}")
-            
             await ctx.send(embed=embed)
             
         except Exception as e:
             await ctx.send("Error getting stonk memes. The SEC must be watching. 👀")
-            logger.error(f"Error in stonks command: {e}")
+            self.logger.error("Error in stonks command: %s", e, extra=log_context(ctx))
+
+    @app_commands.command(name="stonks", description="Fetch a random stock market meme from Reddit")
+    @app_rate_limit()
+    async def stonks_slash(self, interaction: discord.Interaction):
+        # Acknowledge right away; the Reddit request can take a few seconds
+        await interaction.response.defer(thinking=True)
+        try:
+            subreddits = guild_settings.get(interaction.guild_id)["subreddits"] if interaction.guild_id else DEFAULT_GUILD_SETTINGS["subreddits"]
+            embed = await self.bot.loop.run_in_executor(None, self._fetch_meme, subreddits)
+            if embed is None:
+                return await interaction.followup.send("No tendies for you today. Try again when market opens. 📉")
+            await interaction.followup.send(embed=embed)
+            
+        except Exception as e:
+            await interaction.followup.send("Error getting stonk memes. The SEC must be watching. 👀")
+            self.logger.error("Error in stonks slash command: %s", e, extra=log_context(interaction))
+
+    def _fetch_meme(self, subreddits):
+        """Build an embed for a random image post from one of ``subreddits``, or None if there are none."""
+        subreddit = random.choice(subreddits)
+        
+        response = requests.get(f"https://www.reddit.com/r/{subreddit}/hot.json?limit=100", 
+                               headers={"User-agent": "Discord Bot"}, timeout=10)
+        data = response.json()
+        
+        posts = [post for post in data["data"]["children"] 
+                if not post["data"]["is_self"] and not post["data"]["over_18"]]
+        
+        if not posts:
+            return None
+        
+        random_post = random.choice(posts)
+        post_data = random_post["data"]
+        
+        embed = discord.Embed(
+            title=post_data["title"],
+            url=f"https://reddit.com{post_data['permalink']}",
+            color=discord.Color.green() if random.random() > 0.5 else discord.Color.red()
+        )
+        
+        embed.set_image(url=post_data["url"])
+        embed.set_footer(text=f"💎👐 {post_data['ups']} | 🦍 {post_data['num_comments']} | From r/{subreddit}")
+        return embed
     
     @commands.command(name="wsb")
     async def wsb_quote(self, ctx):
@@ -809,6 +2775,15 @@ class FunCog(commands.Cog):
     @commands.command(name="ticker")
     async def ticker_info(self, ctx, symbol: str = None):
         """Gets basic info about a stock ticker"""
+        await ctx.send(embed=self._ticker_embed(symbol))
+
+    @app_commands.command(name="ticker", description="Get basic info about a stock ticker")
+    @app_commands.describe(symbol="Ticker symbol; a random one is picked if omitted")
+    @app_rate_limit()
+    async def ticker_slash(self, interaction: discord.Interaction, symbol: str = None):
+        await interaction.response.send_message(embed=self._ticker_embed(symbol))
+
+    def _ticker_embed(self, symbol):
         if not symbol:
             symbols = ["GME", "TSLA", "AAPL", "MSFT", "PLTR", "SPY", "NVDA", "AMD", "RBLX", "AMC"]
             symbol = random.choice(symbols)
@@ -860,8 +2835,7 @@ class FunCog(commands.Cog):
             ])
         
         embed.set_footer(text=comment)
-        
-        await ctx.send(embed=embed)
+        return embed
     
     @commands.command(name="yolo")
     async def yolo(self, ctx):
@@ -965,12 +2939,927 @@ class FunCog(commands.Cog):
         
         await ctx.send(embed=embed)
 
+# --- Market Commands ---
+ALERTS_FILE = os.getenv("ALERTS_FILE", "alerts.json")
+ALERT_POLL_SECONDS = 60
+MAX_ALERTS_PER_USER = 25
+SYMBOL_PATTERN = re.compile(r"[A-Z][A-Z0-9.\-]{0,9}")
+
+class QuoteProvider:
+    """Latest quotes from Stooq's CSV endpoint, which accepts many symbols per request."""
+    URL = "https://stooq.com/q/l/"
+    BATCH_SIZE = 50
+
+    def fetch(self, symbols):
+        """Return ``{symbol: {"open", "high", "low", "close", "volume"}}``. Blocking."""
+        quotes = {}
+        for start in range(0, len(symbols), self.BATCH_SIZE):
+            batch = symbols[start:start + self.BATCH_SIZE]
+            query = "+".join(f"{symbol.lower()}.us" for symbol in batch)
+            response = requests.get(f"{self.URL}?s={query}&f=sd2t2ohlcv&h&e=csv", timeout=10)
+            response.raise_for_status()
+            metrics["bot_quote_requests_total"] += 1
+            for row in csv.DictReader(io.StringIO(response.text)):
+                # Unknown symbols come back with N/D in every field
+                if row.get("Close") in (None, "", "N/D"):
+                    continue
+                symbol = row["Symbol"].upper().removesuffix(".US")
+                quotes[symbol] = {
+                    "open": float(row["Open"]),
+                    "high": float(row["High"]),
+                    "low": float(row["Low"]),
+                    "close": float(row["Close"]),
+                    "volume": int(float(row["Volume"] or 0)),
+                }
+        return quotes
+
+class AlertBook:
+    """Price alerts indexed per symbol in sorted threshold arrays.
+
+    Each symbol keeps parallel ``(prices, ids)`` lists for "above" and "below"
+    alerts, both sorted by price. A quote at ``p`` triggers ``above[:bisect_right(p)]``
+    and ``below[bisect_left(p):]``, so checking a quote costs O(log n) plus the
+    alerts it fires, however many are set. A per-user index keeps listing and
+    counting one user's alerts independent of the total.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.alerts = {}  # alert_id -> alert
+        self._index = {">": {}, "<": {}}  # direction -> symbol -> (prices, ids)
+        self._by_user = {}  # user_id -> {alert_id: None}, in creation order
+        self._next_id = 1
+        self.dirty = False
+        for alert in read_json(path, []):
+            self._insert(alert)
+
+    def __len__(self):
+        return len(self.alerts)
+
+    def _insert(self, alert):
+        self.alerts[alert["id"]] = alert
+        self._by_user.setdefault(alert["user_id"], {})[alert["id"]] = None
+        self._next_id = max(self._next_id, alert["id"] + 1)
+        prices, ids = self._index[alert["direction"]].setdefault(alert["symbol"], ([], []))
+        i = bisect.bisect_right(prices, alert["price"])
+        prices.insert(i, alert["price"])
+        ids.insert(i, alert["id"])
+
+    def add(self, symbol, direction, price, user_id, channel_id, guild_id):
+        alert = {
+            "id": self._next_id, "symbol": symbol, "direction": direction, "price": price,
+            "user_id": user_id, "channel_id": channel_id, "guild_id": guild_id,
+            "created_at": datetime.datetime.now().isoformat()
+        }
+        self._insert(alert)
+        self.dirty = True
+        return alert
+
+    def _pop(self, alert_id):
+        alert = self.alerts.pop(alert_id)
+        ids = self._by_user[alert["user_id"]]
+        del ids[alert_id]
+        if not ids:
+            del self._by_user[alert["user_id"]]
+        return alert
+
+    def remove(self, alert_id):
+        alert = self._pop(alert_id)
+        by_symbol = self._index[alert["direction"]]
+        prices, ids = by_symbol[alert["symbol"]]
+        # Alerts at the same price sit together, so search only that run for the id
+        i = bisect.bisect_left(prices, alert["price"])
+        while ids[i] != alert_id:
+            i += 1
+        del prices[i], ids[i]
+        if not prices:
+            del by_symbol[alert["symbol"]]
+        self.dirty = True
+        return alert
+
+    def for_user(self, user_id):
+        return [self.alerts[alert_id] for alert_id in self._by_user.get(user_id, ())]
+
+    def symbols(self):
+        """Symbols with at least one active alert; only these are polled."""
+        return sorted(set(self._index[">"]) | set(self._index["<"]))
+
+    def trigger(self, symbol, price):
+        """Remove and return every alert on ``symbol`` crossed by ``price``."""
+        fired = []
+        above = self._index[">"].get(symbol)
+        if above:
+            end = bisect.bisect_right(above[0], price)
+            fired.extend(above[1][:end])
+            del above[0][:end], above[1][:end]
+            if not above[0]:
+                del self._index[">"][symbol]
+        below = self._index["<"].get(symbol)
+        if below:
+            start = bisect.bisect_left(below[0], price)
+            fired.extend(below[1][start:])
+            del below[0][start:], below[1][start:]
+            if not below[0]:
+                del self._index["<"][symbol]
+        if fired:
+            self.dirty = True
+        return [self._pop(alert_id) for alert_id in fired]
+
+    def snapshot(self):
+        self.dirty = False
+        return list(self.alerts.values())
+
+    def save(self, alerts):
+        write_json_atomic(self.path, alerts)
+
+MARKET_DATA_DIR = os.getenv("MARKET_DATA_DIR", "market_data")
+# Daily bars older than this are refreshed from Stooq before charting
+MARKET_DATA_MAX_AGE = 6 * 3600
+# Symbols whose bars are kept in memory after loading from disk
+MARKET_DATA_LOADED = 128
+CHART_CACHE_MAX_BYTES = 64 * 1024 ** 2
+CHART_WORKERS = 2
+CHART_MAX_INDICATORS = 5
+# Trading days shown for each chart range
+CHART_RANGES = {"1m": 21, "3m": 63, "6m": 126, "1y": 252, "2y": 504, "5y": 1260, "max": None}
+INDICATOR_PATTERN = re.compile(r"(sma|ema|bb)(\d{1,3})?")
+
+class OHLCVStore:
+    """Daily bars per symbol, stored as .npz files and refreshed from Stooq when stale.
+
+    Each symbol loads as a dict of NumPy arrays (``date``, ``open``, ``high``, ``low``,
+    ``close``, ``volume``) plus a ``version`` string that changes whenever the data
+    does, for use in cache keys. Recently used symbols stay in memory.
+
+    ``get`` runs on executor threads. Refreshes of one symbol are serialised by a
+    per-symbol lock, and new files are swapped in with ``os.replace``, so a reader
+    never sees a half-written file. If a refresh fails, the stale bars are used.
+    """
+    URL = "https://stooq.com/q/d/l/"
+    logger = logging.getLogger("algobot.market")
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._loaded = OrderedDict()  # symbol -> bars
+        self._lock = threading.Lock()  # guards _loaded and _symbol_locks
+        self._symbol_locks = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, symbol):
+        return os.path.join(self.directory, f"{symbol}.npz")
+
+    def get(self, symbol):
+        """Return bars for ``symbol``, fetching them if missing or stale. Blocking."""
+        path = self._path(symbol)
+        with self._lock:
+            symbol_lock = self._symbol_locks.setdefault(symbol, threading.Lock())
+        # Concurrent charts of a stale symbol wait for one download instead of each starting one
+        with symbol_lock:
+            try:
+                mtime = os.path.getmtime(path)
+            except FileNotFoundError:
+                mtime = None
+            if mtime is None or time.time() - mtime > MARKET_DATA_MAX_AGE:
+                try:
+                    self._download(symbol)
+                except Exception as e:
+                    if mtime is None:
+                        raise
+                    self.logger.warning("Refreshing bars for %s failed, using stale data: %s", symbol, e)
+                mtime = os.path.getmtime(path)
+
+            with self._lock:
+                bars = self._loaded.get(symbol)
+            if bars is None or bars["mtime"] != mtime:
+                with np.load(path) as data:
+                    bars = {name: data[name] for name in data.files}
+                bars["mtime"] = mtime
+                bars["version"] = f"{len(bars['close'])}:{bars['date'][-1]}"
+        with self._lock:
+            self._loaded[symbol] = bars
+            self._loaded.move_to_end(symbol)
+            if len(self._loaded) > MARKET_DATA_LOADED:
+                self._loaded.popitem(last=False)
+        return bars
+
+    def _download(self, symbol):
+        response = requests.get(self.URL, params={"s": f"{symbol.lower()}.us", "i": "d"}, timeout=15)
+        response.raise_for_status()
+        metrics["bot_ohlcv_downloads_total"] += 1
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        if not rows or "Close" not in rows[0]:
+            raise KeyError(symbol)
+        # Write beside the live file and swap it in, so readers see the old or the new file, never half of one
+        temp_path = self._path(symbol) + ".tmp"
+        with open(temp_path, 'wb') as f:
+            np.savez(
+                f,
+                date=np.array([row["Date"] for row in rows], dtype="datetime64[D]"),
+                open=np.array([row["Open"] for row in rows], dtype=float),
+                high=np.array([row["High"] for row in rows], dtype=float),
+                low=np.array([row["Low"] for row in rows], dtype=float),
+                close=np.array([row["Close"] for row in rows], dtype=float),
+                volume=np.array([row.get("Volume") or 0 for row in rows], dtype=float),
+            )
+        os.replace(temp_path, self._path(symbol))
+
+def sma(values, period):
+    """Simple moving average via a cumulative sum; the first ``period - 1`` values are NaN."""
+    out = np.full(len(values), np.nan)
+    if len(values) >= period:
+        cumsum = np.cumsum(np.insert(values, 0, 0.0))
+        out[period - 1:] = (cumsum[period:] - cumsum[:-period]) / period
+    return out
+
+def ema(values, period):
+    """Exponential moving average seeded with the first value, without a Python loop.
+
+    Within a block, ``ema[t] = d**(t+1) * (carry + a * cumsum(x * d**-(k+1)))``.
+    Blocks are kept short enough that ``d**-k`` stays far from overflowing.
+    """
+    values = np.asarray(values, dtype=float)
+    out = np.empty(len(values))
+    if not len(values):
+        return out
+    alpha = 2.0 / (period + 1)
+    decay = 1.0 - alpha
+    block = max(1, int(100 / -np.log10(decay)))
+    out[0] = carry = values[0]
+    for start in range(1, len(values), block):
+        chunk = values[start:start + block]
+        powers = decay ** np.arange(1, len(chunk) + 1)
+        out[start:start + len(chunk)] = powers * (carry + alpha * np.cumsum(chunk / powers))
+        carry = out[start + len(chunk) - 1]
+    return out
+
+def bollinger(values, period, width=2.0):
+    """Middle, upper and lower Bollinger bands over a rolling window."""
+    middle = sma(values, period)
+    deviation = np.full(len(values), np.nan)
+    if len(values) >= period:
+        deviation[period - 1:] = np.lib.stride_tricks.sliding_window_view(values, period).std(axis=-1)
+    return middle, middle + width * deviation, middle - width * deviation
+
+def render_chart(title, dates, opens, highs, lows, closes, lines, bands, candles):
+    """Draw a chart to PNG bytes. Runs in a worker process so matplotlib never touches the gateway loop."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    x = np.arange(len(closes))
+    fig, ax = plt.subplots(figsize=(10, 5), dpi=100)
+    fig.patch.set_facecolor("#2f3136")
+    ax.set_facecolor("#2f3136")
+    if candles:
+        up = closes >= opens
+        colors = np.where(up, "#3ba55c", "#ed4245")
+        ax.vlines(x, lows, highs, colors=colors, linewidth=0.8)
+        ax.bar(x, np.maximum(np.abs(closes - opens), 1e-9), bottom=np.minimum(opens, closes), color=colors, width=0.7)
+    else:
+        ax.plot(x, closes, color="#5865f2", linewidth=1.4, label="Close")
+    for label, upper, lower in bands:
+        ax.fill_between(x, lower, upper, color="#faa61a", alpha=0.12, label=label)
+        ax.plot(x, upper, color="#faa61a", linewidth=0.8)
+        ax.plot(x, lower, color="#faa61a", linewidth=0.8)
+    for label, values in lines:
+        ax.plot(x, values, linewidth=1.1, label=label)
+
+    ticks = np.linspace(0, len(x) - 1, num=min(8, len(x)), dtype=int)
+    ax.set_xticks(ticks)
+    ax.set_xticklabels([str(dates[i]) for i in ticks], rotation=30, ha="right")
+    ax.tick_params(colors="#dcddde")
+    ax.grid(color="#40444b", linewidth=0.5)
+    for spine in ax.spines.values():
+        spine.set_color("#40444b")
+    ax.set_title(title, color="#ffffff")
+    if lines or bands or not candles:
+        ax.legend(facecolor="#36393f", edgecolor="#40444b", labelcolor="#dcddde", fontsize=8)
+    fig.tight_layout()
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", facecolor=fig.get_facecolor())
+    plt.close(fig)
+    return buffer.getvalue()
+
+class ByteLRUCache:
+    """Byte-string values in an LRU bounded by their total size rather than their count."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.total_bytes -= len(old)
+        self._entries[key] = value
+        self.total_bytes += len(value)
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.total_bytes -= len(evicted)
+
+def render_alerts(lines):
+    """Combine alert notifications for one channel into a single message."""
+    return {
+        "content": "\n".join(lines)[:2000],
+        "allowed_mentions": discord.AllowedMentions(users=True, everyone=False, roles=False)
+    }
+
+class MarketCog(commands.Cog):
+    logger = logging.getLogger("algobot.market")
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.quotes = QuoteProvider()
+        self.alert_book = AlertBook(ALERTS_FILE)
+        # Saves run on the default executor; one at a time so an older snapshot can't land last
+        self._alert_save_lock = asyncio.Lock()
+        self.bars = OHLCVStore(MARKET_DATA_DIR)
+        self.chart_cache = ByteLRUCache(CHART_CACHE_MAX_BYTES)
+        self._rendering = {}  # cache key -> future shared by identical in-flight requests
+        # spawn, not fork: a forked child would inherit the gateway loop and its threads
+        self.chart_pool = ProcessPoolExecutor(max_workers=CHART_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+    async def cog_unload(self):
+        self.poll_alerts.cancel()
+        self.chart_pool.shutdown(wait=False, cancel_futures=True)
+
+    @commands.command(name="chart")
+    async def chart(self, ctx, symbol: str, *options: str):
+        """Chart a stock with optional overlays, e.g. `!chart AAPL 6m sma50 bb20`"""
+        symbol = symbol.upper().lstrip("$")
+        if not SYMBOL_PATTERN.fullmatch(symbol):
+            return await ctx.send("Usage: `!chart SYMBOL [range] [sma20|ema50|bb20 ...] [line|candle]`")
+        
+        range_label, indicators, style = "6m", [], None
+        for option in options:
+            option = option.lower()
+            match = INDICATOR_PATTERN.fullmatch(option)
+            if option in CHART_RANGES:
+                range_label = option
+            elif option in ("line", "candle"):
+                style = option
+            elif match:
+                period = int(match.group(2) or 20)
+                if not 2 <= period <= 400:
+                    return await ctx.send("Indicator periods must be between 2 and 400.")
+                indicators.append(f"{match.group(1)}{period}")
+            else:
+                return await ctx.send(f"Unknown option `{option}`. Ranges: {', '.join(CHART_RANGES)}; indicators: sma, ema, bb.")
+        if len(indicators) > CHART_MAX_INDICATORS:
+            return await ctx.send(f"At most {CHART_MAX_INDICATORS} indicators per chart.")
+        candles = style == "candle" or (style is None and (CHART_RANGES[range_label] or 10 ** 6) <= 126)
+        
+        try:
+            bars = await self.bot.loop.run_in_executor(None, self.bars.get, symbol)
+        except KeyError:
+            return await ctx.send(f"No price history found for **${symbol}**.")
+        except Exception as e:
+            self.logger.warning("Error loading bars for %s: %s", symbol, e, extra=log_context(ctx))
+            return await ctx.send("Couldn't fetch price data right now. Try again later.")
+        
+        key = (symbol, range_label, tuple(indicators), candles, bars["version"])
+        png = self.chart_cache.get(key)
+        if png is not None:
+            metrics["bot_chart_cache_hits_total"] += 1
+        else:
+            metrics["bot_chart_cache_misses_total"] += 1
+            future = self._rendering.get(key)
+            if future is None:
+                future = self._rendering[key] = asyncio.ensure_future(self._render(symbol, range_label, indicators, candles, bars))
+                future.add_done_callback(lambda _: self._rendering.pop(key, None))
+            async with ctx.typing():
+                try:
+                    png = await asyncio.shield(future)
+                except Exception as e:
+                    self.logger.error("Error rendering chart for %s: %s", symbol, e, extra=log_context(ctx))
+                    return await ctx.send("An error occurred while drawing the chart.")
+            self.chart_cache.put(key, png)
+        
+        # Symbols with less history than the range (recent listings) chart everything they have
+        count = min(CHART_RANGES[range_label] or len(bars["close"]), len(bars["close"]))
+        last, first = bars["close"][-1], bars["close"][-count]
+        change = (last / first - 1) * 100
+        embed = discord.Embed(
+            title=f"${symbol} • {range_label}",
+            description=f"**Close:** ${last:,.2f} ({change:+.2f}% over range)",
+            color=discord.Color.green() if change >= 0 else discord.Color.red()
+        )
+        embed.set_image(url=f"attachment://{symbol}.png")
+        embed.set_footer(text=f"Daily bars through {bars['date'][-1]} • Data: Stooq")
+        await ctx.send(embed=embed, file=discord.File(io.BytesIO(png), filename=f"{symbol}.png"))
+
+    async def _render(self, symbol, range_label, indicators, candles, bars):
+        # Indicators are computed over the full history so they're warmed up at the left edge
+        count = min(CHART_RANGES[range_label] or len(bars["close"]), len(bars["close"]))
+        window = slice(-count, None)
+        closes = bars["close"]
+        lines, bands = [], []
+        for indicator in indicators:
+            kind, period = INDICATOR_PATTERN.fullmatch(indicator).group(1, 2)
+            period = int(period)
+            if kind == "sma":
+                lines.append((f"SMA {period}", sma(closes, period)[window]))
+            elif kind == "ema":
+                lines.append((f"EMA {period}", ema(closes, period)[window]))
+            else:
+                middle, upper, lower = bollinger(closes, period)
+                bands.append((f"BB {period}", upper[window], lower[window]))
+                lines.append((f"BB {period} mid", middle[window]))
+        
+        return await self.bot.loop.run_in_executor(
+            self.chart_pool, render_chart,
+            f"${symbol} • {range_label}", bars["date"][window], bars["open"][window], bars["high"][window],
+            bars["low"][window], closes[window], lines, bands, candles
+        )
+
+    @commands.command(name="alert")
+    async def alert(self, ctx, symbol: str, direction: str, price: float):
+        """Get pinged when a stock crosses a price, e.g. `!alert TSLA > 300`"""
+        symbol = symbol.upper().lstrip("$")
+        direction = {"above": ">", "below": "<"}.get(direction.lower(), direction)
+        # The float converter accepts `nan` and `inf`, which would corrupt the sorted thresholds
+        if not SYMBOL_PATTERN.fullmatch(symbol) or direction not in ("<", ">") or not math.isfinite(price) or price <= 0:
+            return await ctx.send("Usage: `!alert SYMBOL >|< PRICE`, e.g. `!alert TSLA > 300`")
+        if len(self.alert_book.for_user(ctx.author.id)) >= MAX_ALERTS_PER_USER:
+            return await ctx.send(f"You can have at most {MAX_ALERTS_PER_USER} alerts. Remove one with `!unalert <id>`.")
+        
+        alert = self.alert_book.add(symbol, direction, price, ctx.author.id, ctx.channel.id,
+                                    ctx.guild.id if ctx.guild else None)
+        await self._save_alerts()
+        await ctx.send(f"🔔 Alert #{alert['id']}: I'll ping you when **${symbol}** goes {'above' if direction == '>' else 'below'} ${price:,.2f}.")
+
+    @commands.command(name="alerts")
+    async def alerts(self, ctx):
+        """List your active price alerts"""
+        alerts = self.alert_book.for_user(ctx.author.id)
+        if not alerts:
+            return await ctx.send("You have no active alerts. Set one with `!alert SYMBOL >|< PRICE`.")
+        lines = [f"#{a['id']} **${a['symbol']}** {a['direction']} ${a['price']:,.2f}" for a in alerts]
+        embed = discord.Embed(title="🔔 Your Price Alerts", description="\n".join(lines), color=discord.Color.gold())
+        await ctx.send(embed=embed)
+
+    @commands.command(name="unalert")
+    async def unalert(self, ctx, alert_id: int):
+        """Remove one of your price alerts"""
+        alert = self.alert_book.alerts.get(alert_id)
+        if alert is None or alert["user_id"] != ctx.author.id:
+            return await ctx.send(f"You don't have an alert #{alert_id}.")
+        self.alert_book.remove(alert_id)
+        await self._save_alerts()
+        await ctx.send(f"Removed alert #{alert_id} for **${alert['symbol']}**.")
+
+    @tasks.loop(seconds=ALERT_POLL_SECONDS)
+    async def poll_alerts(self):
+        book = self.alert_book
+        symbols = book.symbols()
+        if symbols:
+            try:
+                quotes = await self.bot.loop.run_in_executor(None, self.quotes.fetch, symbols)
+            except Exception as e:
+                self.logger.warning("Error fetching quotes for alerts: %s", e)
+                quotes = {}
+            
+            for symbol, quote in quotes.items():
+                for alert in book.trigger(symbol, quote["close"]):
+                    channel = self.bot.get_channel(alert["channel_id"])
+                    if channel is None:
+                        continue
+                    word = "above" if alert["direction"] == ">" else "below"
+                    line = (f"<@{alert['user_id']}> 🔔 **${symbol}** is {word} ${alert['price']:,.2f} "
+                            f"(now ${quote['close']:,.2f}) • alert #{alert['id']}")
+                    outbox.coalesce(channel, ("alerts", channel.id), line, render_alerts, window=1)
+                    metrics["bot_price_alerts_fired_total"] += 1
+        
+        await self._save_alerts()
+
+    async def _save_alerts(self):
+        book = self.alert_book
+        if not book.dirty:
+            return
+        # Serialize off the loop; the snapshot is a shallow copy of immutable alert dicts
+        snapshot = book.snapshot()
+        async with self._alert_save_lock:
+            try:
+                await self.bot.loop.run_in_executor(None, book.save, snapshot)
+            except OSError as e:
+                # Keep the book dirty so the next change or poll retries the write
+                book.dirty = True
+                self.logger.error("Error saving price alerts: %s", e)
+
+# --- Watchlist Signals ---
+# One symbol per line; `#` starts a comment. An empty or missing file disables the scanner.
+SCANNER_WATCHLIST = os.getenv("SCANNER_WATCHLIST", "watchlist.txt")
+SCANNER_INTERVAL_MINUTES = 5
+# Indicator periods are in scanner ticks, not days
+SCANNER_EMA_PERIODS = (9, 21)
+SCANNER_BREAKOUT_BARS = 48
+SCANNER_RSI_PERIOD = 14
+SCANNER_RSI_LEVELS = (30, 70)
+# RSI must come back this far inside its levels before the same signal can fire again
+SCANNER_RSI_RESET = 5
+SCANNER_MAX_LINES = 25
+SIGNAL_RULES = {
+    "golden_cross": "📈 EMA {0}/{1} golden cross",
+    "death_cross": "📉 EMA {0}/{1} death cross",
+    "breakout": "🚀 {2}-bar high breakout",
+    "breakdown": "🕳️ {2}-bar low breakdown",
+    "overbought": "🔥 RSI overbought",
+    "oversold": "🧊 RSI oversold",
+}
+
+def load_watchlist(path):
+    """Read the scanner's symbol universe, ignoring blanks, comments and invalid symbols."""
+    try:
+        with open(path, 'r') as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return []
+    symbols = {line.split("#", 1)[0].strip().upper().lstrip("$") for line in lines}
+    return sorted(symbol for symbol in symbols if SYMBOL_PATTERN.fullmatch(symbol))
+
+class SignalScanner:
+    """Screens a whole watchlist at once; row ``i`` of every array belongs to ``symbols[i]``.
+
+    ``closes`` is a ring buffer of the last ``SCANNER_BREAKOUT_BARS`` bars per symbol.
+    EMAs and Wilder's RSI averages are carried as state and advanced by one bar per
+    tick, so a tick costs O(symbols) whatever the history length. ``latched`` marks
+    signals already posted; a signal is posted again only after its reset condition.
+    """
+
+    def __init__(self, symbols):
+        self.symbols = list(symbols)
+        n = len(self.symbols)
+        self.closes = np.full((n, SCANNER_BREAKOUT_BARS), np.nan)
+        self.column = 0
+        self.count = np.zeros(n, dtype=int)
+        self.last = np.full(n, np.nan)
+        self.fast = np.full(n, np.nan)
+        self.slow = np.full(n, np.nan)
+        self.avg_gain = np.zeros(n)
+        self.avg_loss = np.zeros(n)
+        self.latched = np.zeros((n, len(SIGNAL_RULES)), dtype=bool)
+        # Bars a symbol needs before each rule is meaningful, in SIGNAL_RULES order
+        slow, window, rsi = SCANNER_EMA_PERIODS[1], SCANNER_BREAKOUT_BARS + 1, SCANNER_RSI_PERIOD + 1
+        self.warmup = np.array([slow, slow, window, window, rsi, rsi])
+
+    def update(self, prices):
+        """Advance every symbol by one bar and return new signals as ``(symbol, rule, price, rsi)``.
+
+        ``prices`` holds the latest close per symbol, NaN where no quote came back;
+        those symbols keep their state and can't fire this tick.
+        """
+        fresh = ~np.isnan(prices)
+        first = fresh & (self.count == 0)
+        moved = fresh & ~first
+        close = np.where(fresh, prices, self.last)
+
+        # Range of the bars before this one, then overwrite the oldest column
+        prior_high = self.closes.max(axis=1)
+        prior_low = self.closes.min(axis=1)
+        self.closes[:, self.column] = close
+        self.column = (self.column + 1) % SCANNER_BREAKOUT_BARS
+
+        for name, period in zip(("fast", "slow"), SCANNER_EMA_PERIODS):
+            current = getattr(self, name)
+            stepped = current + 2.0 / (period + 1) * (close - current)
+            setattr(self, name, np.where(first, close, np.where(moved, stepped, current)))
+        delta = np.where(moved, close - self.last, 0.0)
+        self.avg_gain = np.where(moved, self.avg_gain + (np.maximum(delta, 0) - self.avg_gain) / SCANNER_RSI_PERIOD, self.avg_gain)
+        self.avg_loss = np.where(moved, self.avg_loss + (np.maximum(-delta, 0) - self.avg_loss) / SCANNER_RSI_PERIOD, self.avg_loss)
+        self.last = close
+        self.count += fresh
+
+        rs = np.divide(self.avg_gain, self.avg_loss, out=np.full(len(close), np.inf), where=self.avg_loss > 0)
+        rsi = np.where((self.avg_gain == 0) & (self.avg_loss == 0), 50.0, 100.0 - 100.0 / (1.0 + rs))
+        low, high = SCANNER_RSI_LEVELS
+        with np.errstate(invalid="ignore"):
+            above = self.fast > self.slow
+            condition = np.column_stack([
+                above, ~above, close > prior_high, close < prior_low, rsi >= high, rsi <= low,
+            ])
+            reset = np.column_stack([
+                ~above, above, close <= prior_high, close >= prior_low,
+                rsi < high - SCANNER_RSI_RESET, rsi > low + SCANNER_RSI_RESET,
+            ])
+        ready = (self.count[:, None] >= self.warmup) & fresh[:, None]
+        condition &= ready
+        # A condition that already holds when a symbol warms up is latched without posting,
+        # so a crossover that happened before the scanner started isn't reported as new
+        warming = self.count[:, None] == self.warmup
+        fire = condition & ~self.latched & ~warming
+        self.latched = (self.latched | condition) & ~reset
+
+        rules = list(SIGNAL_RULES)
+        rows, columns = np.nonzero(fire)
+        return [(self.symbols[row], rules[column], close[row], rsi[row]) for row, column in zip(rows, columns)]
+
+def render_signals(signals):
+    """Build one embed listing a tick's signals, grouped by rule."""
+    signals = sorted(signals, key=lambda signal: (list(SIGNAL_RULES).index(signal[1]), signal[0]))
+    lines = []
+    for symbol, rule, price, rsi in signals[:SCANNER_MAX_LINES]:
+        label = SIGNAL_RULES[rule].format(*SCANNER_EMA_PERIODS, SCANNER_BREAKOUT_BARS)
+        lines.append(f"**${symbol}** {label} • ${price:,.2f} • RSI {rsi:.0f}")
+    if len(signals) > SCANNER_MAX_LINES:
+        lines.append(f"…and {len(signals) - SCANNER_MAX_LINES} more")
+    return discord.Embed(title="📡 Watchlist Signals", description="\n".join(lines), color=discord.Color.blurple())
+
+scanner = SignalScanner(load_watchlist(SCANNER_WATCHLIST))
+
+@tasks.loop(minutes=SCANNER_INTERVAL_MINUTES)
+async def signal_scanner():
+    if not scanner.symbols:
+        return
+    try:
+        quotes = await bot.loop.run_in_executor(None, QuoteProvider().fetch, scanner.symbols)
+    except Exception as e:
+        logger.warning("Error fetching quotes for the watchlist scanner: %s", e)
+        return
+    prices = np.array([quotes[symbol]["close"] if symbol in quotes else np.nan for symbol in scanner.symbols])
+    # Outside market hours nothing moves; skip so idle ticks don't count as bars
+    if np.array_equal(prices, scanner.last, equal_nan=True):
+        return
+    
+    signals = scanner.update(prices)
+    metrics["bot_scanner_ticks_total"] += 1
+    metrics["bot_scanner_signals_total"] += len(signals)
+    if not signals:
+        return
+    embed = render_signals(signals)
+    for guild in bot.guilds:
+        channel = guild.get_channel(guild_settings.get(guild.id)["signal_channel_id"] or 0)
+        if channel is not None:
+            outbox.send(channel, embed=embed)
+
+# --- Auto Moderation ---
+# Thresholds as (count, seconds): crossing `count` within `seconds` triggers the rule
+AUTOMOD_MESSAGE_LIMIT = (6, 5)
+AUTOMOD_DUPLICATE_LIMIT = (3, 30)
+AUTOMOD_MENTION_LIMIT = (8, 30)
+AUTOMOD_CHANNEL_LIMIT = (30, 10)
+AUTOMOD_JOIN_LIMIT = (10, 10)
+# Recent messages kept per user; must be at least the largest message count above
+AUTOMOD_HISTORY = 10
+# Users and channels tracked at once; the least recently active are forgotten first
+AUTOMOD_MAX_TRACKED = 50000
+AUTOMOD_TIMEOUT = datetime.timedelta(minutes=10)
+AUTOMOD_SLOWMODE_SECONDS = 10
+# Seconds a raid stays active after the last join that looked like part of it
+RAID_COOLDOWN = 300
+AUTOMOD_ACTIONS = {
+    "spam": {"delete", "timeout"},
+    "flood": {"slowmode", "lockdown"},
+    "raid": {"lockdown", "timeout"},
+}
+
+class BoundedTrackers(OrderedDict):
+    """Ring buffers keyed by entity, forgetting the least recently active past ``limit``."""
+
+    def __init__(self, factory, limit=AUTOMOD_MAX_TRACKED):
+        super().__init__()
+        self.factory = factory
+        self.limit = limit
+
+    def touch(self, key):
+        ring = self.get(key)
+        if ring is None:
+            ring = self[key] = self.factory()
+            if len(self) > self.limit:
+                self.popitem(last=False)
+        else:
+            self.move_to_end(key)
+        return ring
+
+def window_full(ring, limit, now):
+    """True if the ring holds ``count`` timestamps that all fall within ``seconds`` of now."""
+    count, seconds = limit
+    return len(ring) >= count and now - ring[-count] <= seconds
+
+class AutoModCog(commands.Cog):
+    """Sliding-window spam, flood and raid detection on the message and join paths.
+
+    Every tracked user, channel and guild owns one fixed-size deque, so memory per
+    entity is constant and each check scans at most AUTOMOD_HISTORY entries.
+    """
+    logger = logging.getLogger("algobot.automod")
+
+    def __init__(self, bot):
+        self.bot = bot
+        # (guild_id, user_id) -> deque of (timestamp, content hash, mention count)
+        self.users = BoundedTrackers(lambda: deque(maxlen=AUTOMOD_HISTORY))
+        # channel_id -> deque of message timestamps
+        self.channels = BoundedTrackers(lambda: deque(maxlen=AUTOMOD_CHANNEL_LIMIT[0]))
+        # guild_id -> deque of join timestamps
+        self.joins = BoundedTrackers(lambda: deque(maxlen=AUTOMOD_JOIN_LIMIT[0]))
+        self.raids = {}  # guild_id -> monotonic time the raid state expires
+        self._locking = set()  # guild_ids with a lockdown edit in flight
+        self._tasks = set()
+
+    def _spawn(self, coro):
+        # Actions run as tasks so detection on the message path never waits on the API
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @commands.Cog.listener()
+    async def on_message(self, message):
+        if message.guild is None or message.author.bot:
+            return
+        settings = guild_settings.get(message.guild.id)
+        if not settings["automod_enabled"] or message.author.guild_permissions.manage_messages:
+            return
+
+        now = time.monotonic()
+        channel_ring = self.channels.touch(message.channel.id)
+        channel_ring.append(now)
+        if window_full(channel_ring, AUTOMOD_CHANNEL_LIMIT, now):
+            channel_ring.clear()
+            metrics["bot_automod_triggered_total{rule=\"flood\"}"] += 1
+            self._spawn(self._act(message.guild, "flood", settings, channel=message.channel,
+                                  reason=f"{AUTOMOD_CHANNEL_LIMIT[0]} messages in {AUTOMOD_CHANNEL_LIMIT[1]}s"))
+
+        ring = self.users.touch((message.guild.id, message.author.id))
+        content_hash = hash(message.content.strip().lower())
+        mentions = len(message.raw_mentions) + len(message.raw_role_mentions) + (5 if message.mention_everyone else 0)
+        ring.append((now, content_hash, mentions))
+
+        reason = None
+        if len(ring) >= AUTOMOD_MESSAGE_LIMIT[0] and now - ring[-AUTOMOD_MESSAGE_LIMIT[0]][0] <= AUTOMOD_MESSAGE_LIMIT[1]:
+            reason = f"{AUTOMOD_MESSAGE_LIMIT[0]} messages in {AUTOMOD_MESSAGE_LIMIT[1]}s"
+        elif message.content and sum(
+            1 for ts, h, _ in ring if h == content_hash and now - ts <= AUTOMOD_DUPLICATE_LIMIT[1]
+        ) >= AUTOMOD_DUPLICATE_LIMIT[0]:
+            reason = f"{AUTOMOD_DUPLICATE_LIMIT[0]} duplicate messages in {AUTOMOD_DUPLICATE_LIMIT[1]}s"
+        elif mentions and sum(
+            n for ts, _, n in ring if now - ts <= AUTOMOD_MENTION_LIMIT[1]
+        ) >= AUTOMOD_MENTION_LIMIT[0]:
+            reason = f"{AUTOMOD_MENTION_LIMIT[0]} mentions in {AUTOMOD_MENTION_LIMIT[1]}s"
+
+        if reason:
+            # Start a fresh window so one burst triggers one set of actions
+            ring.clear()
+            metrics["bot_automod_triggered_total{rule=\"spam\"}"] += 1
+            self._spawn(self._act(message.guild, "spam", settings, member=message.author,
+                                  message=message, reason=reason))
+
+    async def check_join(self, member):
+        """Record a join and return True while the guild is being raided."""
+        guild = member.guild
+        settings = guild_settings.get(guild.id)
+        if not settings["automod_enabled"]:
+            return False
+
+        now = time.monotonic()
+        ring = self.joins.touch(guild.id)
+        ring.append(now)
+        if window_full(ring, AUTOMOD_JOIN_LIMIT, now):
+            if guild.id not in self.raids:
+                metrics["bot_automod_triggered_total{rule=\"raid\"}"] += 1
+                self._spawn(self._act(guild, "raid", settings,
+                                      reason=f"{AUTOMOD_JOIN_LIMIT[0]} joins in {AUTOMOD_JOIN_LIMIT[1]}s"))
+            self.raids[guild.id] = now + RAID_COOLDOWN
+        elif self.raids.get(guild.id, 0) < now:
+            self.raids.pop(guild.id, None)
+            return False
+
+        if "timeout" in settings["automod_actions"].get("raid", []):
+            self._spawn(self._timeout(member, "Joined during a raid"))
+        return True
+
+    async def _act(self, guild, rule, settings, member=None, channel=None, message=None, reason=""):
+        actions = settings["automod_actions"].get(rule, [])
+        self.logger.warning("Automod %s triggered: %s", rule, reason,
+                            extra={"guild": guild.id, "user": member.id if member else None,
+                                   "channel": channel.id if channel else None})
+        results = []
+        try:
+            if "delete" in actions and message is not None:
+                await message.delete()
+                results.append("deleted message")
+            if "timeout" in actions and member is not None:
+                await self._timeout(member, reason)
+                results.append(f"timed out for {int(AUTOMOD_TIMEOUT.total_seconds() // 60)}m")
+            if "slowmode" in actions and channel is not None:
+                await channel.edit(slowmode_delay=AUTOMOD_SLOWMODE_SECONDS, reason=f"Automod: {reason}")
+                results.append(f"slowmode {AUTOMOD_SLOWMODE_SECONDS}s in {channel.mention}")
+            if "lockdown" in actions:
+                await self._lockdown(guild, reason)
+                results.append("server locked down")
+        except discord.HTTPException as e:
+            self.logger.error("Automod action failed: %s", e, extra={"guild": guild.id})
+            results.append(f"action failed: {e.text or e.status}")
+
+        moderation = self.bot.get_cog("ModerationCog")
+        if moderation:
+            moderation.modlog.record(guild.id, f"automod:{rule}", self.bot.user, user=member,
+                                     channel_id=channel.id if channel else None, reason=reason,
+                                     context=", ".join(results))
+
+        log_channel = guild.get_channel(settings["automod_log_channel_id"] or 0) or guild.system_channel
+        if log_channel:
+            embed = discord.Embed(title=f"🚨 Automod: {rule}", description=reason, color=discord.Color.red())
+            if member:
+                embed.add_field(name="Member", value=member.mention)
+            embed.add_field(name="Actions", value=", ".join(results) or "none")
+            outbox.send(log_channel, embed=embed)
+
+    async def _timeout(self, member, reason):
+        await member.timeout(AUTOMOD_TIMEOUT, reason=f"Automod: {reason}")
+
+    async def _lockdown(self, guild, reason):
+        if guild.id in self._locking or guild_settings.get(guild.id)["automod_lockdown_level"] is not None:
+            return
+        previous = guild.verification_level
+        self._locking.add(guild.id)
+        try:
+            await guild.edit(verification_level=discord.VerificationLevel.highest, reason=f"Automod lockdown: {reason}")
+            # Only remembered once the edit took effect, so a failed lockdown can't block unlocking
+            guild_settings.set(guild.id, "automod_lockdown_level", previous.value)
+        finally:
+            self._locking.discard(guild.id)
+
+    @commands.group(name="automod")
+    @commands.guild_only()
+    @commands.has_permissions(administrator=True)
+    async def automod(self, ctx):
+        """Show or change auto moderation (Admin only)"""
+        # Not invoke_without_command, so the admin check above also guards every subcommand
+        if ctx.invoked_subcommand is not None:
+            return
+        settings = guild_settings.get(ctx.guild.id)
+        embed = discord.Embed(title="🚨 Auto Moderation", color=discord.Color.red())
+        embed.add_field(name="Enabled", value="Yes" if settings["automod_enabled"] else "No")
+        embed.add_field(name="Raid", value="Active" if self.raids.get(ctx.guild.id, 0) > time.monotonic() else "None")
+        embed.add_field(name="Locked Down", value="No" if settings["automod_lockdown_level"] is None else "Yes")
+        for rule in AUTOMOD_ACTIONS:
+            embed.add_field(name=f"{rule.title()} Actions", value=", ".join(settings["automod_actions"].get(rule, [])) or "none")
+        await ctx.send(embed=embed)
+
+    @automod.command(name="on")
+    async def automod_on(self, ctx):
+        guild_settings.set(ctx.guild.id, "automod_enabled", True)
+        await ctx.send("Auto moderation enabled.")
+
+    @automod.command(name="off")
+    async def automod_off(self, ctx):
+        guild_settings.set(ctx.guild.id, "automod_enabled", False)
+        await ctx.send("Auto moderation disabled.")
+
+    @automod.command(name="actions")
+    async def automod_actions(self, ctx, rule: str, *actions: str):
+        """Set the actions for `spam`, `flood` or `raid`, e.g. `!automod actions spam delete timeout`"""
+        rule = rule.lower()
+        if rule not in AUTOMOD_ACTIONS:
+            return await ctx.send(f"Unknown rule. Choose from: {', '.join(AUTOMOD_ACTIONS)}")
+        actions = [action.lower() for action in actions]
+        invalid = [action for action in actions if action not in AUTOMOD_ACTIONS[rule]]
+        if invalid:
+            return await ctx.send(f"`{rule}` supports: {', '.join(sorted(AUTOMOD_ACTIONS[rule]))}")
+        configured = dict(guild_settings.get(ctx.guild.id)["automod_actions"])
+        configured[rule] = actions
+        guild_settings.set(ctx.guild.id, "automod_actions", configured)
+        await ctx.send(f"`{rule}` actions: {', '.join(actions) or 'none (alert only)'}")
+
+    @automod.command(name="logchannel")
+    async def automod_logchannel(self, ctx, channel: discord.TextChannel):
+        guild_settings.set(ctx.guild.id, "automod_log_channel_id", channel.id)
+        await ctx.send(f"Automod alerts will be posted in {channel.mention}.")
+
+    @automod.command(name="unlock")
+    async def automod_unlock(self, ctx):
+        """End a raid and restore the server's verification level"""
+        self.raids.pop(ctx.guild.id, None)
+        saved = guild_settings.get(ctx.guild.id)["automod_lockdown_level"]
+        if saved is None:
+            return await ctx.send("The server isn't locked down.")
+        level = discord.VerificationLevel(saved)
+        await ctx.guild.edit(verification_level=level, reason=f"Automod lockdown lifted by {ctx.author}")
+        guild_settings.set(ctx.guild.id, "automod_lockdown_level", None)
+        self.bot.get_cog("ModerationCog")._record(ctx, "unlock", context=f"Verification level restored to {level}")
+        await ctx.send("Lockdown lifted.")
+
 async def setup_bot():
     await bot.add_cog(MusicCog(bot))
     await bot.add_cog(ModerationCog(bot))
     await bot.add_cog(UtilityCog(bot))
     await bot.add_cog(FunCog(bot))
+    await bot.add_cog(AutoModCog(bot))
+    await bot.add_cog(MarketCog(bot))
 
+# The only on_ready handler; start every background loop here
 @bot.event
 async def on_ready():
     try:
@@ -982,6 +3871,10 @@ async def on_ready():
     
     # Start background tasks
     status_updater.start()
+    if not flush_usage_stats.is_running():
+        flush_usage_stats.start()
+    if not signal_scanner.is_running():
+        signal_scanner.start()
     
     # Load polls and reminders if they exist (from UtilityCog)
     utility_cog = bot.get_cog("UtilityCog")
@@ -989,6 +3882,14 @@ async def on_ready():
         utility_cog.load_data()
         utility_cog.check_reminders.start()
     
+    moderation_cog = bot.get_cog("ModerationCog")
+    if moderation_cog:
+        moderation_cog.resume_massrole_jobs()
+    
+    market_cog = bot.get_cog("MarketCog")
+    if market_cog and not market_cog.poll_alerts.is_running():
+        market_cog.poll_alerts.start()
+    
     # Log all registered prefix commands for debugging
     registered_commands = [command.name for command in bot.commands]
     logger.info("Registered prefix commands: %s", registered_commands)
@@ -1000,10 +3901,14 @@ async def hello(ctx):
     logger.info("Received hello command from %s", ctx.author)
     await ctx.send("Hello!")
 
-# Run the bot using the token from environment variables
-token = os.getenv('TOKEN')
-if not token:
-    logger.error("TOKEN not found in environment variables.")
-else:
-    logger.info("Starting Discord bot...")
-    bot.run(token)
\ No newline at end of file
+# Run the bot using the token from environment variables. Guarded so tools such as
+# loadtest.py can import the bot and its cogs without connecting to Discord.
+if __name__ == "__main__":
+    health_thread.start()
+    token = os.getenv('TOKEN')
+    if not token:
+        logger.error("TOKEN not found in environment variables.")
+    else:
+        logger.info("Starting Discord bot...")
+        # log_handler=None keeps discord.py's records flowing through our queue pipeline
+        bot.run(token, log_handler=None)
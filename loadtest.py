@@ -0,0 +1,359 @@
+"""Offline command-throughput load test for bot.py.
+
+Builds the real ``commands.Bot`` with all of its cogs, but replaces the gateway
+with synthetic guilds and messages and the REST client with an in-process fake,
+so it runs without a token or network access. Messages are injected at a fixed
+rate across many guilds and channels and fed straight into ``process_commands``.
+
+Reports p50/p99 command latency, outbound HTTP calls by route, event-loop lag,
+and writes a flame graph of the event-loop thread sampled during the run.
+The bot runs in a temporary working directory, so the polls, reminders,
+databases and caches it writes never touch the checkout.
+
+    python loadtest.py --rate 200 --duration 30 --guilds 50 --flamegraph flame.svg
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter
+from html import escape
+
+import discord
+
+import bot as botmod
+
+# Command lines sent by the synthetic users, with relative weights. Commands that
+# need voice or destructive permissions are left out.
+COMMAND_MIX = [
+    ("!hello", 5),
+    ("!wsb", 10),
+    ("!ticker", 10),
+    ("!ticker TSLA", 5),
+    ("!jpow", 5),
+    ("!yolo", 10),
+    ("!help", 5),
+    ("!help fun", 3),
+    ("!poll \"Moon or dust?\" Moon Dust", 3),
+    ("!serverinfo", 3),
+    ("!userinfo", 3),
+    ("!avatar", 3),
+    ("!stonks", 5),
+    ("just chatting, not a command", 30),
+]
+
+
+class FakeDiscord:
+    """Stands in for the gateway and REST API of a bot connected to many guilds."""
+
+    def __init__(self, bot, guilds, channels, users, http_latency):
+        self.bot = bot
+        self.http_latency = http_latency
+        self.http_calls = Counter()
+        self._next_id = 10 ** 17
+        self.state = bot._connection
+        self.bot_user = self._user_payload(self._snowflake(), "LoadTestBot", bot=True)
+        self.state.user = discord.ClientUser(state=self.state, data=self.bot_user)
+        self.guilds = [self._add_guild(i, channels, users) for i in range(guilds)]
+
+    def _snowflake(self):
+        self._next_id += 1
+        return self._next_id
+
+    def _timestamp(self):
+        return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+    def _user_payload(self, user_id, name, bot=False):
+        return {"id": str(user_id), "username": name, "discriminator": "0", "global_name": name,
+                "avatar": None, "bot": bot}
+
+    def _member_payload(self, user):
+        return {"user": user, "roles": [], "joined_at": self._timestamp(), "deaf": False, "mute": False, "flags": 0}
+
+    def _add_guild(self, index, channels, users):
+        guild_id = self._snowflake()
+        user_payloads = [self._user_payload(self._snowflake(), f"user{index}_{i}") for i in range(users)]
+        data = {
+            "id": str(guild_id),
+            "name": f"Load Test Guild {index}",
+            "owner_id": user_payloads[0]["id"],
+            "member_count": users + 1,
+            "features": [],
+            "emojis": [],
+            "stickers": [],
+            "roles": [{"id": str(guild_id), "name": "@everyone", "permissions": "1071698660929",
+                       "position": 0, "color": 0, "hoist": False, "managed": False, "mentionable": False}],
+            "channels": [{"id": str(self._snowflake()), "type": 0, "name": f"channel-{i}", "position": i,
+                          "permission_overwrites": []} for i in range(channels)],
+            "members": [self._member_payload(user) for user in user_payloads + [self.bot_user]],
+        }
+        guild = self.state._add_guild_from_data(data)
+        return guild, user_payloads
+
+    def message(self, content):
+        """Build a synthetic gateway MESSAGE_CREATE from a random user in a random channel."""
+        guild, users = random.choice(self.guilds)
+        channel = random.choice(guild.text_channels)
+        user = random.choice(users)
+        data = self._message_payload(channel.id, user, content)
+        data["guild_id"] = str(guild.id)
+        data["member"] = {key: value for key, value in self._member_payload(user).items() if key != "user"}
+        return discord.Message(state=self.state, channel=channel, data=data)
+
+    def _message_payload(self, channel_id, author, content, embeds=None):
+        return {
+            "id": str(self._snowflake()), "channel_id": str(channel_id), "author": author,
+            "content": content or "", "embeds": embeds or [], "attachments": [], "mentions": [],
+            "mention_roles": [], "mention_everyone": False, "pinned": False, "tts": False, "type": 0,
+            "timestamp": self._timestamp(), "edited_timestamp": None,
+        }
+
+    async def request(self, route, *, files=None, form=None, **kwargs):
+        """Replacement for ``HTTPClient.request`` that answers like Discord's REST API."""
+        self.http_calls[f"{route.method} {route.path}"] += 1
+        if self.http_latency:
+            await asyncio.sleep(self.http_latency)
+        if route.method == "POST" and route.path == "/channels/{channel_id}/messages":
+            payload = kwargs.get("json") or {}
+            if form:
+                payload = json.loads(next(part["value"] for part in form if part["name"] == "payload_json"))
+            return self._message_payload(route.channel_id, self.bot_user, payload.get("content"), payload.get("embeds"))
+        if route.method == "GET" and route.path == "/users/{user_id}":
+            return self._user_payload(self._snowflake(), "fetched")
+        return None
+
+    def fake_requests_get(self, url, **kwargs):
+        """Replacement for ``requests.get`` used by commands that call external APIs."""
+        self.http_calls[f"GET {url.split('?')[0]}"] += 1
+        time.sleep(self.http_latency)
+        posts = [{"data": {"is_self": False, "over_18": False, "title": f"Meme {i}", "permalink": f"/r/x/{i}",
+                           "url": f"https://i.example.invalid/{i}.png", "ups": i, "num_comments": i}}
+                 for i in range(25)]
+        return _FakeResponse({"data": {"children": posts}})
+
+
+class _FakeResponse:
+    def __init__(self, payload):
+        self._payload = payload
+
+    def json(self):
+        return self._payload
+
+
+class StackSampler(threading.Thread):
+    """Samples the event-loop thread's Python stack into folded-stack counts."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def render_flamegraph(stacks, title, width=1200, row_height=16):
+    """Render folded stack counts as a standalone SVG flame graph."""
+    root = {"children": {}, "value": 0}
+    for stack, count in stacks.items():
+        root["value"] += count
+        node = root
+        for name in stack.split(";"):
+            node = node["children"].setdefault(name, {"children": {}, "value": 0})
+            node["value"] += count
+
+    rects = []
+    max_depth = 0
+
+    def layout(node, x, depth):
+        nonlocal max_depth
+        max_depth = max(max_depth, depth)
+        for name, child in sorted(node["children"].items()):
+            child_width = child["value"] / root["value"] * width
+            if child_width >= 0.5:
+                rects.append((name, x, depth, child_width, child["value"]))
+                layout(child, x, depth + 1)
+            x += child_width
+
+    if root["value"]:
+        layout(root, 0.0, 0)
+    height = (max_depth + 2) * row_height + 30
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" font-family="monospace" font-size="11">',
+        f'<text x="{width / 2}" y="18" text-anchor="middle" font-size="14">{escape(title)}</text>',
+    ]
+    for name, x, depth, rect_width, value in rects:
+        y = height - (depth + 1) * row_height
+        hue = zlib.crc32(name.encode()) % 60
+        label = escape(name)
+        pct = value / root["value"] * 100
+        parts.append(
+            f'<g><title>{label} ({value} samples, {pct:.1f}%)</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{rect_width:.1f}" height="{row_height - 1}" fill="hsl({hue},85%,60%)"/>'
+        )
+        if rect_width > 40:
+            chars = int(rect_width / 7)
+            text = label if len(name) <= chars else escape(name[:chars - 2]) + ".."
+            parts.append(f'<text x="{x + 3:.1f}" y="{y + row_height - 4}">{text}</text>')
+        parts.append("</g>")
+    parts.append("</svg>")
+    return "\n".join(parts)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+async def monitor_loop_lag(samples, interval=0.05):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - start - interval)
+
+
+async def run(args):
+    bot = botmod.bot
+    await bot._async_setup_hook()
+    await botmod.setup_bot()
+    if args.no_ratelimit:
+        bot.remove_check(botmod.rate_limit_check)
+
+    fake = FakeDiscord(bot, args.guilds, args.channels, args.users, args.http_latency)
+    bot.http.request = fake.request
+    botmod.requests.get = fake.fake_requests_get
+
+    lines = [line for line, _ in COMMAND_MIX]
+    weights = [weight for _, weight in COMMAND_MIX]
+    latencies = []
+    errors = Counter()
+    in_flight = set()
+
+    async def handle(message):
+        start = time.perf_counter()
+        try:
+            await bot.process_commands(message)
+        except Exception as e:
+            errors[type(e).__name__] += 1
+        latencies.append(time.perf_counter() - start)
+
+    lag_samples = []
+    lag_task = asyncio.create_task(monitor_loop_lag(lag_samples))
+    sampler = StackSampler(threading.get_ident(), args.sample_interval / 1000)
+    sampler.start()
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    injected = 0
+    while loop.time() - started < args.duration:
+        # Inject however many messages are due since the start, so sleep jitter doesn't lower the rate
+        due = int((loop.time() - started) * args.rate) - injected
+        for _ in range(due):
+            task = asyncio.create_task(handle(fake.message(random.choices(lines, weights)[0])))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        injected += max(due, 0)
+        await asyncio.sleep(0.005)
+
+    if in_flight:
+        await asyncio.wait(in_flight, timeout=args.drain_timeout)
+    elapsed = loop.time() - started
+    sampler.stop()
+    lag_task.cancel()
+
+    rejected = sum(value for name, value in botmod.metrics.items() if name.startswith("bot_ratelimit_rejected_total"))
+    results = {
+        "injected": injected,
+        "completed": len(latencies),
+        "elapsed_s": round(elapsed, 2),
+        "throughput_msgs_per_s": round(len(latencies) / elapsed, 1),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+            "max": round(max(latencies, default=0) * 1000, 2),
+        },
+        "loop_lag_ms": {
+            "p50": round(percentile(lag_samples, 50) * 1000, 2),
+            "p99": round(percentile(lag_samples, 99) * 1000, 2),
+            "max": round(max(lag_samples, default=0) * 1000, 2),
+        },
+        "http_calls": dict(fake.http_calls.most_common()),
+        "http_calls_total": sum(fake.http_calls.values()),
+        "rate_limited": rejected,
+        "errors": dict(errors),
+    }
+
+    if args.flamegraph:
+        with open(args.flamegraph, "w") as f:
+            f.write(render_flamegraph(sampler.stacks, f"Event loop, {args.rate} msg/s for {args.duration}s"))
+        with open(args.flamegraph.rsplit(".", 1)[0] + ".folded", "w") as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in sampler.stacks.most_common())
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rate", type=float, default=100, help="messages injected per second")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to inject for")
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--channels", type=int, default=5, help="text channels per guild")
+    parser.add_argument("--users", type=int, default=50, help="members per guild")
+    parser.add_argument("--http-latency", type=float, default=0.05, help="simulated REST round trip in seconds")
+    parser.add_argument("--sample-interval", type=float, default=2, help="stack sampling interval in milliseconds")
+    parser.add_argument("--drain-timeout", type=float, default=30, help="seconds to wait for in-flight commands")
+    parser.add_argument("--no-ratelimit", action="store_true", help="remove the global rate-limit check")
+    parser.add_argument("--flamegraph", default="loadtest_flame.svg", help="SVG output path; empty to skip")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    logging.getLogger().setLevel(args.log_level)
+    # Output paths are relative to where the harness was started, not the scratch directory
+    if args.flamegraph:
+        args.flamegraph = os.path.abspath(args.flamegraph)
+    if args.json:
+        args.json = os.path.abspath(args.json)
+    
+    # The bot's data files are relative paths; `!poll` alone would otherwise fill the tracked polls.json
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="algobot-loadtest-") as workdir:
+        os.chdir(workdir)
+        try:
+            results = asyncio.run(run(args))
+        finally:
+            os.chdir(cwd)
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()